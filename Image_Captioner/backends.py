@@ -0,0 +1,270 @@
+import io
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it', 'its',
+    'of', 'on', 'or', 'that', 'the', 'their', 'there', 'this', 'to', 'two', 'with', 'while', 'near',
+}
+
+
+class LocalResponse:
+    """Minimal stand-in for a Gemini response."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+class CaptionBackend:
+    """Model engine behind ImageCaptioner's generate_* methods."""
+
+    name = 'base'
+    supports_structured_output = False
+    supports_streaming = False
+    rate_limited = False
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.images = 0
+        self._first_started = None
+        self._last_finished = None
+        self._stats_lock = threading.Lock()
+
+    def generate(self, task: Optional[str], prompt: str, parts: List[Any], generation_config=None, stream: bool = False) -> Any:
+        """Return a response with a .text attribute, or an iterable of chunks when stream=True."""
+        raise NotImplementedError
+
+    def cores(self) -> int:
+        return os.cpu_count() or 1
+
+    def _record(self, images: int, started: float):
+        with self._stats_lock:
+            self.images += images
+            if self._first_started is None or started < self._first_started:
+                self._first_started = started
+            self._last_finished = time.perf_counter()
+
+    def throughput(self) -> Dict[str, float]:
+        with self._stats_lock:
+            seconds = (self._last_finished - self._first_started) if self.images else 0.0
+        images_per_second = self.images / seconds if seconds > 0 else 0.0
+        return {
+            'images': self.images,
+            'seconds': seconds,
+            'images_per_second': images_per_second,
+            'images_per_second_per_core': images_per_second / self.cores(),
+        }
+
+
+class GeminiBackend(CaptionBackend):
+    name = 'gemini'
+    supports_structured_output = True
+    supports_streaming = True
+    rate_limited = True
+
+    def __init__(self, model: Any, model_name: str):
+        super().__init__(model_name)
+        self.model = model
+
+    def generate(self, task, prompt, parts, generation_config=None, stream=False):
+        started = time.perf_counter()
+        response = self.model.generate_content([prompt, *parts], generation_config=generation_config, stream=stream)
+        self._record(1, started)
+        return response
+
+
+class DynamicBatcher:
+    """Collects concurrent single-image requests into batches of up to max_batch_size, waiting at most max_wait_ms."""
+
+    def __init__(self, run_batch: Callable[[List[Image.Image], int], List[str]], max_batch_size: int = 8, max_wait_ms: float = 20):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_images = 0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._loop, name='caption-batcher', daemon=True).start()
+
+    def submit(self, image: Image.Image, max_new_tokens: int) -> Future:
+        future = Future()
+        self._queue.put((image, max_new_tokens, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                texts = self.run_batch([image for image, _, _ in batch], max(tokens for _, tokens, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_images += len(batch)
+            for (_, _, future), text in zip(batch, texts):
+                future.set_result(text)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.batched_images / self.batches if self.batches else 0.0
+
+
+def keywords_from_caption(caption: str, limit: int = 15) -> List[str]:
+    keywords = []
+    for word in re.findall(r"[a-zA-Z][a-zA-Z'-]+", caption.lower()):
+        if word not in STOPWORDS and word not in keywords:
+            keywords.append(word)
+    return keywords[:limit]
+
+
+def format_local_output(task: Optional[str], caption: str) -> str:
+    """Shape a plain image-to-text caption into the output each task expects."""
+    caption = ' '.join(caption.split())
+    sentence = caption[:1].upper() + caption[1:]
+    if task == 'alt_text':
+        return sentence[:125]
+    if task == 'keywords':
+        return ', '.join(keywords_from_caption(caption))
+    if task == 'social_caption':
+        hashtags = ' '.join('#' + word.replace("'", '').replace('-', '') for word in keywords_from_caption(caption, 3))
+        return f"{sentence} ✨ {hashtags}".strip()
+    return sentence
+
+
+def _to_pil(part: Any) -> Image.Image:
+    if isinstance(part, Image.Image):
+        return part.convert('RGB')
+    return Image.open(io.BytesIO(part['data'])).convert('RGB')
+
+
+class TransformersBackend(CaptionBackend):
+    """Local CPU image-to-text engine with dynamic batching and optional int8 dynamic quantization."""
+
+    name = 'transformers'
+
+    def __init__(
+        self,
+        model: Any,
+        image_processor: Any,
+        tokenizer: Any,
+        model_name: str = 'local',
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        max_new_tokens: Optional[Dict[str, int]] = None,
+    ):
+        import torch
+
+        super().__init__(model_name)
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model.eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.image_processor = image_processor
+        self.tokenizer = tokenizer
+        self.quantized = quantize
+        self.max_new_tokens = {'detailed_caption': 48, 'social_caption': 32}
+        self.max_new_tokens.update(max_new_tokens or {})
+        self.batcher = DynamicBatcher(self._run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    @classmethod
+    def from_pretrained(cls, model_name: str = 'nlpconnect/vit-gpt2-image-captioning', **kwargs) -> 'TransformersBackend':
+        from transformers import AutoImageProcessor, AutoTokenizer, VisionEncoderDecoderModel
+
+        return cls(
+            VisionEncoderDecoderModel.from_pretrained(model_name),
+            AutoImageProcessor.from_pretrained(model_name),
+            AutoTokenizer.from_pretrained(model_name),
+            model_name=model_name,
+            **kwargs,
+        )
+
+    @classmethod
+    def tiny_random(cls, seed: int = 0, **kwargs) -> 'TransformersBackend':
+        """A randomly initialized ViT-GPT2 with an in-memory vocabulary; needs no downloads."""
+        import torch
+        from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+        from transformers import (
+            GPT2Config,
+            PreTrainedTokenizerFast,
+            VisionEncoderDecoderConfig,
+            VisionEncoderDecoderModel,
+            ViTConfig,
+            ViTImageProcessor,
+        )
+
+        torch.manual_seed(seed)
+        words = "a dog cat person car tree street grass sky red blue green sitting standing on in with near".split()
+        vocab = {'<pad>': 0, '<bos>': 1, '<eos>': 2, '<unk>': 3}
+        for word in words:
+            vocab[word] = len(vocab)
+        word_level = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+        word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+        word_level.decoder = decoders.WordPiece()
+        tokenizer = PreTrainedTokenizerFast(
+            tokenizer_object=word_level, pad_token='<pad>', bos_token='<bos>', eos_token='<eos>', unk_token='<unk>'
+        )
+
+        config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(
+            ViTConfig(hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64, image_size=32, patch_size=8),
+            GPT2Config(
+                vocab_size=len(vocab), n_embd=32, n_layer=2, n_head=2, n_positions=64,
+                bos_token_id=1, eos_token_id=2, pad_token_id=0,
+            ),
+        )
+        config.decoder_start_token_id = 1
+        config.pad_token_id = 0
+        config.eos_token_id = 2
+        return cls(
+            VisionEncoderDecoderModel(config=config),
+            ViTImageProcessor(size={'height': 32, 'width': 32}),
+            tokenizer,
+            model_name='tiny-random-vit-gpt2',
+            **kwargs,
+        )
+
+    def cores(self) -> int:
+        import torch
+
+        return torch.get_num_threads()
+
+    def _run_batch(self, images: List[Image.Image], max_new_tokens: int) -> List[str]:
+        import torch
+
+        pixel_values = self.image_processor(images=images, return_tensors='pt').pixel_values
+        with torch.inference_mode():
+            output_ids = self.model.generate(pixel_values, max_new_tokens=max_new_tokens, num_beams=1, do_sample=False)
+        return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+    def caption(self, image: Image.Image, task: Optional[str] = None) -> str:
+        started = time.perf_counter()
+        caption = self.batcher.submit(image, self.max_new_tokens.get(task, 20)).result()
+        self._record(1, started)
+        return caption
+
+    def generate(self, task, prompt, parts, generation_config=None, stream=False):
+        if generation_config is not None or stream:
+            raise NotImplementedError("The local backend only supports plain single-task requests")
+        # Image-to-text models take a single image, so multi-frame uploads are captioned from their first part.
+        return LocalResponse(format_local_output(task, self.caption(_to_pil(parts[0]), task)))
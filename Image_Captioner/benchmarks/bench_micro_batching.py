@@ -0,0 +1,92 @@
+"""Latency versus throughput of micro-batched alt-text requests under a fixed requests-per-minute quota.
+
+Runs offline against FakeGenerativeModel:
+
+    python benchmarks/bench_micro_batching.py --images 64 --batch-sizes 1 2 4 8 16 --rpm 120
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from backends import GeminiBackend
+from benchmarks.common import environment, make_images, percentile, write_report
+from benchmarks.fake_model import FakeGenerativeModel
+from image_captioner import ImageCaptioner
+from rate_limiter import RateLimiter, TokenBucket
+
+
+def run_batch_size(images: List[Image.Image], batch_size: int, args) -> Dict[str, Any]:
+    model = FakeGenerativeModel(
+        latency=args.latency,
+        per_image_latency=args.per_image_latency,
+        failure_rate=args.failure_rate,
+        drop_slot_rate=args.drop_slot_rate,
+        seed=args.seed,
+    )
+    limiter = RateLimiter(requests_per_minute=args.rpm, max_concurrency=args.concurrency, base_delay=0.05)
+    # Start from an empty bucket so the quota binds from the first request, as it would mid-job.
+    limiter.requests = TokenBucket(args.rpm, capacity=1)
+    captioner = ImageCaptioner(
+        'benchmark',
+        backend=GeminiBackend(model, model.model_name),
+        max_concurrency=args.concurrency,
+        rate_limiter=limiter,
+    )
+    for image in images:
+        captioner.prepare(image)
+
+    started = time.perf_counter()
+    results = captioner.generate_batch('alt_text', images, batch_size=batch_size)
+    seconds = time.perf_counter() - started
+    return {
+        'batch_size': batch_size,
+        'images': len(images),
+        'failed_images': sum(isinstance(result, Exception) for result in results),
+        'requests': model.calls,
+        'batch_requests': captioner.batch_requests,
+        'individual_retries': captioner.batch_retries,
+        'seconds': round(seconds, 3),
+        'images_per_second': round(len(images) / seconds, 3),
+        'images_per_minute_at_quota': round(args.rpm * len(images) / max(model.calls, 1), 1),
+        'request_latency_mean': round(statistics.fmean(model.latencies), 3) if model.latencies else 0.0,
+        'request_latency_p95': round(percentile(model.latencies, 0.95), 3),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rpm', type=float, default=120, help="Requests per minute quota")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.4, help="Fixed seconds per request")
+    parser.add_argument('--per-image-latency', type=float, default=0.05, help="Extra seconds per image in a request")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests that fail with a 503")
+    parser.add_argument('--drop-slot-rate', type=float, default=0.0, help="Fraction of batch slots left out of responses")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="Write JSON here instead of stdout")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    images = make_images(args.images, seed=args.seed)
+    report = {
+        'benchmark': 'micro_batching',
+        'environment': environment(),
+        'config': vars(args),
+        'results': [run_batch_size(images, batch_size, args) for batch_size in args.batch_sizes],
+    }
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Query latency, recall and memory of the semantic index at scale, on synthetic clustered vectors.
+
+    python benchmarks/bench_semantic_index.py --rows 1000000 -o index.json
+
+Vectors are drawn around random topic centres so the IVF lists have realistic structure. Recall@k is
+measured against the exact brute-force result for the same queries.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.common import environment, summarize, write_report
+from benchmarks.memory_probe import peak_rss_bytes
+from semantic_index import EmbeddingIndex, normalize
+
+
+def clustered_vectors(rng: np.random.Generator, centres: np.ndarray, count: int, noise: float) -> np.ndarray:
+    picks = rng.integers(len(centres), size=count)
+    return normalize(centres[picks] + noise * rng.standard_normal((count, centres.shape[1]), dtype=np.float32))
+
+
+def fill_index(index: EmbeddingIndex, rng: np.random.Generator, centres: np.ndarray, rows: int, noise: float, batch: int = 100_000):
+    for start in range(0, rows, batch):
+        count = min(batch, rows - start)
+        ids = [f"image-{row}" for row in range(start, start + count)]
+        index.add(ids, ids, clustered_vectors(rng, centres, count, noise))
+
+
+def time_queries(index: EmbeddingIndex, queries: np.ndarray, k: int, nprobe):
+    seconds, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append([hit['row'] for hit in index.search(query, k=k, nprobe=nprobe)])
+        seconds.append(time.perf_counter() - started)
+    return seconds, results
+
+
+def recall(results, exact) -> float:
+    return float(np.mean([len(set(got) & set(want)) / max(len(want), 1) for got, want in zip(results, exact)]))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the memory-mapped semantic index.")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float16')
+    parser.add_argument('--topics', type=int, default=2000, help="Synthetic topic centres")
+    parser.add_argument('--noise', type=float, default=0.05, help="Per-component spread around each topic centre")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 32])
+    parser.add_argument('--directory', help="Index directory to (re)use; default is a temporary directory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    centres = normalize(rng.standard_normal((args.topics, args.dim), dtype=np.float32))
+    directory = args.directory or tempfile.mkdtemp(prefix='semantic-index-')
+    try:
+        index = EmbeddingIndex(directory, dim=args.dim, dtype=args.dtype, embedder='synthetic')
+        started = time.perf_counter()
+        if len(index) < args.rows:
+            fill_index(index, rng, centres, args.rows - len(index), args.noise)
+        append_seconds = time.perf_counter() - started
+
+        queries = clustered_vectors(rng, centres, args.queries, args.noise)
+        baseline_rss = peak_rss_bytes()
+        brute_seconds, exact = time_queries(index, queries, args.k, None)
+        brute_rss = peak_rss_bytes() - baseline_rss
+
+        started = time.perf_counter()
+        nlist = index.build_ivf()
+        build_seconds = time.perf_counter() - started
+
+        ivf = []
+        for nprobe in args.nprobe:
+            time_queries(index, queries[:5], args.k, nprobe)
+            seconds, results = time_queries(index, queries, args.k, nprobe)
+            ivf.append({'name': f"ivf_nprobe_{nprobe}", 'nprobe': nprobe, 'seconds': summarize(seconds), 'recall_at_k': round(recall(results, exact), 4)})
+
+        report = {
+            'benchmark': 'semantic_index',
+            'environment': environment(),
+            'config': vars(args),
+            'results': {
+                'index': {
+                    'rows': len(index),
+                    'vector_bytes': os.path.getsize(os.path.join(directory, 'vectors.bin')),
+                    'append_seconds': round(append_seconds, 2),
+                    'ivf_lists': nlist,
+                    'ivf_build_seconds': round(build_seconds, 2),
+                },
+                'queries': [{'name': 'brute_force', 'seconds': summarize(brute_seconds), 'recall_at_k': 1.0, 'peak_rss_added_bytes': brute_rss}] + ivf,
+            },
+        }
+        write_report(report, args.output)
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
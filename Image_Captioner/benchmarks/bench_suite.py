@@ -0,0 +1,280 @@
+"""Offline benchmarks for the Image Captioner request path, written as JSON for comparison between commits.
+
+    python benchmarks/bench_suite.py -o results.json
+    python benchmarks/bench_suite.py --quick --compare results.json
+
+All model calls go to FakeGenerativeModel, so runs need no API key and are repeatable. --latency and
+--failure-rate set the simulated model; injected failures are 503s that the rate limiter retries.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from backends import GeminiBackend
+from benchmarks.common import compare, environment, make_images, percentile, summarize, write_report
+from benchmarks.fake_model import FakeGenerativeModel
+from hedging import HedgePolicy
+from image_captioner import TASK_METHODS, ImageCaptioner
+from image_preprocessing import PreprocessConfig, open_image, preprocess_image
+from rate_limiter import RateLimiter
+
+SECTIONS = ('methods', 'generate_all', 'preprocessing', 'memory', 'concurrency', 'hedging')
+
+
+def make_captioner(args, max_concurrency: int = 4, hedge: Optional[HedgePolicy] = None) -> ImageCaptioner:
+    model = FakeGenerativeModel(
+        latency=args.latency,
+        per_image_latency=args.per_image_latency,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+    )
+    limiter = RateLimiter(requests_per_minute=1_000_000, max_concurrency=max_concurrency, base_delay=0.01, max_delay=0.1)
+    return ImageCaptioner(
+        'benchmark',
+        backend=GeminiBackend(model, model.model_name),
+        max_concurrency=max_concurrency,
+        rate_limiter=limiter,
+        hedge=hedge,
+    )
+
+
+def upload_bytes(image: Image.Image, quality: int = 90) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def gradient_image(megapixels: float) -> Image.Image:
+    """A smooth photo-like image of roughly the given size; cheap to build even at tens of megapixels."""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    return Image.merge('RGB', (
+        Image.linear_gradient('L').resize((width, height)),
+        Image.radial_gradient('L').resize((width, height)),
+        Image.linear_gradient('L').rotate(90).resize((width, height)),
+    ))
+
+
+def bench_methods(args) -> List[Dict[str, Any]]:
+    """Latency of each public generate_* method on fresh images (no cache hits)."""
+    captioner = make_captioner(args)
+    results = []
+    for offset, method in enumerate(list(TASK_METHODS.values()) + ['generate_all_structured', 'generate_all']):
+        seconds = []
+        for image in make_images(args.repeats, seed=args.seed + offset):
+            started = time.perf_counter()
+            try:
+                getattr(captioner, method)(image)
+            except Exception:
+                pass
+            seconds.append(time.perf_counter() - started)
+        results.append({'name': method, 'seconds': summarize(seconds)})
+    return results
+
+
+def bench_generate_all(args) -> List[Dict[str, Any]]:
+    """What the Generate All Content button costs, from uploaded bytes to all four results."""
+    results = []
+    for fused in (True, False):
+        captioner = make_captioner(args)
+        seconds = []
+        for image in make_images(args.repeats, size=1024, seed=args.seed + 100 + int(fused)):
+            data = upload_bytes(image)
+            started = time.perf_counter()
+            uploaded = Image.open(io.BytesIO(data))
+            captioner.prepare(uploaded)
+            if fused:
+                captioner.generate_all(uploaded)
+            else:
+                dict(captioner.generate_concurrently(uploaded))
+            seconds.append(time.perf_counter() - started)
+        results.append({'name': 'fused' if fused else 'concurrent', 'seconds': summarize(seconds)})
+    return results
+
+
+def bench_preprocessing(args) -> List[Dict[str, Any]]:
+    """Open, decode and preprocess_image cost per megapixel of the uploaded image, with and without reduce-on-decode."""
+    results = []
+    for megapixels in args.megapixels:
+        data = upload_bytes(gradient_image(megapixels))
+        for image_format, reduce_on_decode in (('JPEG', False), ('JPEG', True), ('WEBP', True)):
+            config = PreprocessConfig(format=image_format)
+            seconds = []
+            for _ in range(args.repeats):
+                started = time.perf_counter()
+                if reduce_on_decode:
+                    image, _ = open_image(io.BytesIO(data), config)
+                else:
+                    image = Image.open(io.BytesIO(data))
+                with image:
+                    preprocess_image(image, config, len(data))
+                seconds.append(time.perf_counter() - started)
+            timing = summarize(seconds)
+            results.append({
+                'name': f"{megapixels}mp_{image_format.lower()}" + ('_reduce_on_decode' if reduce_on_decode else '_full_decode'),
+                'megapixels': megapixels,
+                'format': image_format,
+                'reduce_on_decode': reduce_on_decode,
+                'seconds': timing,
+                'seconds_per_megapixel': round(timing['p50'] / megapixels, 5),
+            })
+    return results
+
+
+def bench_memory(args) -> List[Dict[str, Any]]:
+    """Peak resident memory added by decoding and preprocessing one upload, per image size."""
+    probe = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'memory_probe.py')
+    results = []
+    for megapixels in args.megapixels:
+        data = upload_bytes(gradient_image(megapixels))
+        for mode in ('full_decode', 'reduce_on_decode'):
+            # A fresh process per measurement, so each peak belongs to that image and path alone.
+            command = [sys.executable, probe] + (['--reduce-on-decode'] if mode == 'reduce_on_decode' else [])
+            completed = subprocess.run(command, input=data, capture_output=True, check=True)
+            peak = int(completed.stdout)
+            results.append({
+                'name': f"{megapixels}mp_{mode}",
+                'megapixels': megapixels,
+                'mode': mode,
+                'upload_bytes': len(data),
+                'peak_rss_bytes': peak,
+                'peak_rss_bytes_per_megapixel': round(peak / megapixels),
+            })
+    return results
+
+
+def bench_concurrency(args) -> List[Dict[str, Any]]:
+    """Images per second for alt-text over a bulk workload at each concurrency level."""
+    results = []
+    for concurrency in args.concurrency:
+        captioner = make_captioner(args, max_concurrency=concurrency)
+        images = make_images(args.images, seed=args.seed + 1000 + concurrency)
+
+        def caption(image):
+            try:
+                captioner.run_task('alt_text', image)
+                return True
+            except Exception:
+                return False
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            succeeded = sum(executor.map(caption, images))
+        seconds = time.perf_counter() - started
+        results.append({
+            'name': f"concurrency_{concurrency}",
+            'concurrency': concurrency,
+            'images': len(images),
+            'errors': len(images) - succeeded,
+            'retries': captioner.rate_limiter.retries,
+            'seconds': round(seconds, 3),
+            'images_per_second': round(len(images) / seconds, 3),
+        })
+    return results
+
+
+def bench_hedging(args) -> List[Dict[str, Any]]:
+    """Alt-text latency tail with and without hedging, under a simulated slow-call tail."""
+    results = []
+    for budget in [0.0] + args.hedge_budgets:
+        hedge = HedgePolicy(budget=budget, min_samples=10) if budget else None
+        captioner = make_captioner(args, max_concurrency=8, hedge=hedge)
+        seconds = []
+        for image in make_images(args.hedge_requests, seed=args.seed + 2000):
+            started = time.perf_counter()
+            try:
+                captioner.run_task('alt_text', image)
+            except Exception:
+                pass
+            seconds.append(time.perf_counter() - started)
+        summary = hedge.summary() if hedge else {'hedge_rate': 0.0, 'hedge_win_rate': 0.0}
+        results.append({
+            'name': f"hedge_budget_{budget:g}",
+            'budget': budget,
+            'seconds': summarize(seconds),
+            'p99': round(percentile(seconds, 0.99), 4),
+            'hedge_rate': round(summary['hedge_rate'], 4),
+            'hedge_win_rate': round(summary['hedge_win_rate'], 4),
+            'model_calls': captioner.backend.model.calls,
+        })
+    return results
+
+
+BENCHMARKS = {
+    'methods': bench_methods,
+    'generate_all': bench_generate_all,
+    'preprocessing': bench_preprocessing,
+    'memory': bench_memory,
+    'concurrency': bench_concurrency,
+    'hedging': bench_hedging,
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Image Captioner request path.")
+    parser.add_argument('--sections', nargs='+', choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument('--latency', type=float, default=0.2, help="Simulated seconds per model request")
+    parser.add_argument('--per-image-latency', type=float, default=0.0, help="Extra simulated seconds per image in a request")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of model requests that fail with a 503")
+    parser.add_argument('--tail-rate', type=float, default=0.05, help="Fraction of model requests that are slow")
+    parser.add_argument('--tail-latency', type=float, default=1.0, help="Extra simulated seconds for a slow request")
+    parser.add_argument('--hedge-budgets', type=float, nargs='+', default=[0.05, 0.1], help="Hedging budgets to compare against no hedging")
+    parser.add_argument('--hedge-requests', type=int, default=200, help="Sequential requests per hedging run")
+    parser.add_argument('--repeats', type=int, default=10, help="Samples per latency measurement")
+    parser.add_argument('--images', type=int, default=64, help="Images per concurrency run")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[0.5, 2, 8, 24])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help="Small, fast settings for a smoke run")
+    parser.add_argument('--compare', metavar='BASELINE', help="Also print relative changes against a previous report")
+    parser.add_argument('-o', '--output', help="Write JSON here instead of stdout")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.quick:
+        args.latency = min(args.latency, 0.02)
+        args.repeats = min(args.repeats, 3)
+        args.images = min(args.images, 16)
+        args.concurrency = [c for c in args.concurrency if c <= 4] or [1]
+        args.megapixels = [m for m in args.megapixels if m <= 2] or [0.5]
+        args.hedge_requests = min(args.hedge_requests, 60)
+        args.tail_latency = min(args.tail_latency, 0.2)
+
+    results = {}
+    for section in args.sections:
+        started = time.perf_counter()
+        results[section] = BENCHMARKS[section](args)
+        print(f"{section}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {
+        'benchmark': 'image_captioner_suite',
+        'environment': environment(),
+        'config': vars(args),
+        'results': results,
+    }
+    write_report(report, args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for row in compare(baseline, report):
+            print(f"{row['metric']}: {row['baseline']:g} -> {row['current']:g} ({row['change']:+.1%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
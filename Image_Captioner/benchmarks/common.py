@@ -0,0 +1,84 @@
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+
+def make_images(count: int, size: int = 256, seed: int = 0) -> List[Image.Image]:
+    """Noise images: distinct digests and perceptual hashes, so caches and dedupe never short-circuit a run."""
+    rng = random.Random(seed)
+    return [Image.frombytes('RGB', (size, size), rng.randbytes(size * size * 3)) for _ in range(count)]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(seconds),
+        'mean': round(statistics.fmean(seconds), 4) if seconds else 0.0,
+        'p50': round(percentile(seconds, 0.5), 4),
+        'p95': round(percentile(seconds, 0.95), 4),
+        'max': round(max(seconds), 4) if seconds else 0.0,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def write_report(report: Dict[str, Any], output: Optional[str]):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def flatten(report: Any, prefix: str = '') -> Dict[str, float]:
+    """Numeric leaves keyed by dotted path; list items are keyed by their 'name' field or position."""
+    values = {}
+    if isinstance(report, dict):
+        for key, value in report.items():
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(report, list):
+        for position, item in enumerate(report):
+            name = item.get('name', position) if isinstance(item, dict) else position
+            values.update(flatten(item, f"{prefix}{name}."))
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        values[prefix.rstrip('.')] = float(report)
+    return values
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Relative change of every metric present in both reports."""
+    before, after = flatten(baseline.get('results', {})), flatten(current.get('results', {}))
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] if before[key] else 0.0
+        rows.append({'metric': key, 'baseline': before[key], 'current': after[key], 'change': round(change, 4)})
+    return rows
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Any, List, Optional, get_origin
+
+from google.api_core import exceptions as google_exceptions
+from PIL import Image
+
+WORDS = "red blue green dog cat person car tree street grass sky water city beach mountain sunset portrait food".split()
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int, output_tokens: int):
+        self.text = text
+        self.usage_metadata = type('UsageMetadata', (), {
+            'prompt_token_count': prompt_tokens,
+            'candidates_token_count': output_tokens,
+            'total_token_count': prompt_tokens + output_tokens,
+        })()
+
+
+def _part_digest(part: Any) -> str:
+    if isinstance(part, Image.Image):
+        data = part.tobytes()
+    elif isinstance(part, dict):
+        data = part['data']
+    else:
+        data = str(part).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _words_for(digest: str, count: int) -> List[str]:
+    rng = random.Random(digest)
+    return [rng.choice(WORDS) for _ in range(count)]
+
+
+class FakeGenerativeModel:
+    """Deterministic stand-in for genai.GenerativeModel with simulated latency and injected failures.
+
+    Each call sleeps latency + per_image_latency * images, plus tail_latency on a tail_rate fraction of
+    calls. Outputs depend only on the image bytes, and failures, slow calls and dropped batch slots come
+    from a seeded generator, so runs are repeatable.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.4,
+        per_image_latency: float = 0.05,
+        failure_rate: float = 0.0,
+        drop_slot_rate: float = 0.0,
+        seed: int = 0,
+        model_name: str = 'fake-gemini',
+        tail_rate: float = 0.0,
+        tail_latency: float = 0.0,
+    ):
+        self.latency = latency
+        self.per_image_latency = per_image_latency
+        self.failure_rate = failure_rate
+        self.drop_slot_rate = drop_slot_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.model_name = model_name
+        self.calls = 0
+        self.failures = 0
+        self.latencies = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _respond(self, prompt: str, images: List[Any], generation_config: Optional[Any]) -> str:
+        schema = getattr(generation_config, 'response_schema', None) if generation_config is not None else None
+        digests = [_part_digest(part) for part in images]
+        if get_origin(schema) is list:
+            items = []
+            for index, digest in enumerate(digests, 1):
+                with self._lock:
+                    dropped = self._rng.random() < self.drop_slot_rate
+                if not dropped:
+                    separator = ', ' if 'comma-separated' in prompt else ' '
+                    items.append({'index': index, 'result': separator.join(_words_for(digest, 8))})
+            return json.dumps(items)
+        if schema is not None:
+            words = _words_for(''.join(digests), 30)
+            return json.dumps({
+                'detailed_caption': ' '.join(words),
+                'alt_text': ' '.join(words[:10]),
+                'keywords': sorted(set(words[:12])),
+                'social_caption': ' '.join(words[:12]) + ' #' + words[0],
+            })
+        words = _words_for(''.join(digests) + prompt, 40)
+        if 'comma-separated' in prompt:
+            return ', '.join(words[:12])
+        return ' '.join(words)
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        started = time.perf_counter()
+        prompt = ''.join(part for part in contents if isinstance(part, str))
+        images = [part for part in contents if not isinstance(part, str)]
+        with self._lock:
+            slow = self._rng.random() < self.tail_rate
+        time.sleep(self.latency + self.per_image_latency * len(images) + (self.tail_latency if slow else 0.0))
+        with self._lock:
+            self.calls += 1
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        if failed:
+            raise google_exceptions.ServiceUnavailable("Injected failure")
+
+        text = self._respond(prompt, images, generation_config)
+        response = FakeResponse(text, len(prompt) // 4 + 258 * len(images), len(text) // 4)
+        with self._lock:
+            self.latencies.append(time.perf_counter() - started)
+        if stream:
+            words = text.split(' ')
+            return iter(FakeResponse(word + (' ' if i < len(words) - 1 else ''), 0, 0) for i, word in enumerate(words))
+        return response
@@ -0,0 +1,43 @@
+"""Peak RSS added by decoding and preprocessing one upload read from stdin; prints bytes.
+
+With --reduce-on-decode the upload is opened through open_image, as the app and CLI do, instead of a
+plain Image.open.
+
+Run as a separate process by bench_suite.py so only PIL and the preprocessing code are loaded.
+"""
+import io
+import os
+import resource
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from image_preprocessing import PreprocessConfig, open_image, preprocess_image
+
+
+def peak_rss_bytes() -> int:
+    # On Linux ru_maxrss survives fork/exec and would start at the parent's peak; VmHWM is this process's own.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+if __name__ == '__main__':
+    data = sys.stdin.buffer.read()
+    config = PreprocessConfig()
+    baseline = peak_rss_bytes()
+    if '--reduce-on-decode' in sys.argv[1:]:
+        image, _ = open_image(io.BytesIO(data), config)
+    else:
+        image = Image.open(io.BytesIO(data))
+    with image:
+        preprocess_image(image, config, len(data))
+    print(peak_rss_bytes() - baseline)
@@ -0,0 +1,446 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from PIL import Image
+
+from backends import GeminiBackend, TransformersBackend
+from client_pool import create_gemini_model
+from image_captioner import MICRO_BATCH_TASKS, PREPARED_IMAGE_SLOTS, TASK_METHODS, ImageCaptioner
+from hedging import HedgePolicy
+from image_preprocessing import PreprocessConfig, open_image
+from metrics import CaptionerMetrics, opentelemetry_tracer, serve_metrics, write_metrics_file
+from perceptual_hash import PerceptualIndex
+from rate_limiter import RateLimiter
+from result_cache import ResultCache
+from router import ModelRouter, RoutedBackend
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'}
+
+
+def iter_image_paths(source: str) -> Iterator[str]:
+    """Lazily yield image paths from a directory tree or a manifest (.txt paths or .jsonl with a "path" field)."""
+    if os.path.isdir(source):
+        stack = [source]
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.abspath(entry.path)
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = json.loads(line)['path'] if line.startswith('{') else line
+            yield os.path.abspath(os.path.join(base_dir, path))
+
+
+class JsonlResultWriter:
+    """Append-only JSONL output; a torn last line from a crash is ignored on resume."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def completed_paths(self) -> Set[str]:
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding='utf-8') as existing:
+            for line in existing:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if row.get('status') == 'ok':
+                    completed.add(row['path'])
+        return completed
+
+    def __enter__(self):
+        needs_newline = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if needs_newline:
+            with open(self.path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                needs_newline = existing.read(1) != b'\n'
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if needs_newline:
+            self._file.write('\n')
+        return self
+
+    def write(self, row: Dict[str, Any]):
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """Parquet output as a directory of part files, one per flushed batch of rows."""
+
+    def __init__(self, directory: str, rows_per_part: int = 1000):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise SystemExit("Parquet output requires pyarrow: pip install pyarrow") from e
+        self.directory = directory
+        self.rows_per_part = rows_per_part
+        self._rows = []
+
+    def completed_paths(self) -> Set[str]:
+        import pyarrow.parquet as pq
+
+        completed = set()
+        if not os.path.isdir(self.directory):
+            return completed
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.parquet'):
+                continue
+            table = pq.read_table(os.path.join(self.directory, name), columns=['path', 'status'])
+            for path, status in zip(table.column('path').to_pylist(), table.column('status').to_pylist()):
+                if status == 'ok':
+                    completed.add(path)
+        return completed
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return self
+
+    def write(self, row: Dict[str, Any]):
+        self._rows.append({
+            'path': row['path'],
+            'status': row['status'],
+            'results': json.dumps(row.get('results', {}), ensure_ascii=False),
+            'errors': json.dumps(row.get('errors', {}), ensure_ascii=False),
+            'parts_sent': row.get('parts_sent'),
+            'bytes_sent': row.get('bytes_sent'),
+            'bytes_saved': row.get('bytes_saved'),
+            'seconds': row['seconds'],
+        })
+        if len(self._rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Write to a temporary name first so a crash never leaves a half-written part behind.
+        name = f"part-{time.time_ns()}.parquet"
+        temp_path = os.path.join(self.directory, '.' + name)
+        pq.write_table(pa.Table.from_pylist(self._rows), temp_path)
+        os.replace(temp_path, os.path.join(self.directory, name))
+        self._rows = []
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def _record_upload(captioner: ImageCaptioner, image: Image.Image, path: str, row: Dict[str, Any]):
+    parts, _, prepared = captioner.prepare(image)
+    row['parts_sent'] = len(parts)
+    if prepared:
+        row['bytes_sent'] = sum(len(item.data) for item in prepared)
+        row['bytes_saved'] = max(0, os.path.getsize(path) - row['bytes_sent'])
+
+
+def _run_remaining_tasks(captioner: ImageCaptioner, image: Image.Image, path: str, row: Dict[str, Any], tasks: List[str], fused: bool):
+    remaining = [task for task in tasks if task not in row['results'] and task not in row['errors']]
+    if fused and len(remaining) > 1:
+        try:
+            structured = captioner.generate_all_structured(image)
+            row['results'].update({task: structured[task] for task in remaining if task in structured})
+        except Exception as e:
+            logger.debug("Structured request failed for %s: %s", path, e)
+
+    for task in remaining:
+        if task in row['results']:
+            continue
+        try:
+            row['results'][task] = captioner.run_task(task, image)
+        except Exception as e:
+            row['errors'][task] = f"{type(e).__name__}: {e}"
+
+
+def _finish_row(row: Dict[str, Any], started: float) -> Dict[str, Any]:
+    row['status'] = 'error' if row['errors'] else 'ok'
+    row['seconds'] = round(time.perf_counter() - started, 3)
+    return row
+
+
+def caption_image(captioner: ImageCaptioner, path: str, tasks: List[str], fused: bool) -> Dict[str, Any]:
+    started = time.perf_counter()
+    row = {'path': path, 'results': {}, 'errors': {}}
+    try:
+        image, _ = open_image(path, captioner.preprocess)
+        with image:
+            image.load()
+            _record_upload(captioner, image, path, row)
+            _run_remaining_tasks(captioner, image, path, row, tasks, fused)
+    except Exception as e:
+        row['errors']['image'] = f"{type(e).__name__}: {e}"
+
+    return _finish_row(row, started)
+
+
+def caption_batch(captioner: ImageCaptioner, paths: List[str], tasks: List[str], fused: bool) -> List[Dict[str, Any]]:
+    """Caption a group of images, packing micro-batchable tasks for all of them into shared requests."""
+    if len(paths) == 1:
+        return [caption_image(captioner, paths[0], tasks, fused)]
+
+    started = time.perf_counter()
+    rows, images = [], []
+    try:
+        for path in paths:
+            row = {'path': path, 'results': {}, 'errors': {}}
+            rows.append(row)
+            try:
+                image, _ = open_image(path, captioner.preprocess)
+                image.load()
+                _record_upload(captioner, image, path, row)
+                images.append((row, image))
+            except Exception as e:
+                row['errors']['image'] = f"{type(e).__name__}: {e}"
+
+        for task in tasks:
+            if task not in MICRO_BATCH_TASKS or not images:
+                continue
+            values = captioner.generate_batch(task, [image for _, image in images], batch_size=len(images))
+            for (row, _), value in zip(images, values):
+                if isinstance(value, Exception):
+                    row['errors'][task] = f"{type(value).__name__}: {value}"
+                else:
+                    row['results'][task] = value
+
+        for row, image in images:
+            _run_remaining_tasks(captioner, image, row['path'], row, tasks, fused)
+    finally:
+        for _, image in images:
+            image.close()
+
+    return [_finish_row(row, started) for row in rows]
+
+
+class ThroughputReporter:
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.done = 0
+        self.errors = 0
+
+    def record(self, row: Dict[str, Any]):
+        self.done += 1
+        if row['status'] != 'ok':
+            self.errors += 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            logger.info(self.summary())
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        error_rate = self.errors / self.done if self.done else 0.0
+        return (
+            f"{self.done} images in {elapsed:.1f}s "
+            f"({self.done / elapsed:.2f} images/s, error rate {error_rate:.1%})"
+        )
+
+
+def run(
+    captioner: ImageCaptioner,
+    paths: Iterator[str],
+    writer,
+    tasks: List[str],
+    workers: int,
+    fused: bool,
+    reporter: Optional[ThroughputReporter] = None,
+    micro_batch: int = 1,
+) -> ThroughputReporter:
+    """Caption paths on a bounded worker pool, writing each row as soon as its group completes."""
+    reporter = reporter or ThroughputReporter()
+    max_in_flight = workers * 2
+    pending = set()
+
+    def drain(return_when):
+        nonlocal pending
+        done, pending = wait(pending, return_when=return_when)
+        for future in done:
+            for row in future.result():
+                writer.write(row)
+                reporter.record(row)
+                if row['status'] != 'ok':
+                    logger.warning("Failed %s: %s", row['path'], row['errors'])
+
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for group in iter(lambda: list(islice(paths, max(1, micro_batch))), []):
+            pending.add(executor.submit(caption_batch, captioner, group, tasks, fused))
+            if len(pending) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+        while pending:
+            drain(FIRST_COMPLETED)
+
+    return reporter
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Caption a directory or manifest of images with Gemini.")
+    parser.add_argument('source', help="Image directory, or a manifest of paths (.txt) or {\"path\": ...} objects (.jsonl)")
+    parser.add_argument('-o', '--output', required=True, help="Output .jsonl file, or a directory for Parquet parts")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help="Output format (default: from the output suffix)")
+    parser.add_argument('--tasks', nargs='+', choices=list(TASK_METHODS), default=list(TASK_METHODS))
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent images in flight")
+    parser.add_argument('--no-fused', dest='fused', action='store_false', help="Send one prompt per task instead of one structured request")
+    parser.add_argument('--backend', choices=['gemini', 'local'], default='gemini', help="Gemini API or a local CPU image-to-text model")
+    parser.add_argument('--local-model', default='nlpconnect/vit-gpt2-image-captioning', help="Hugging Face model for --backend local")
+    parser.add_argument('--quantize', action='store_true', help="int8 dynamic quantization for --backend local")
+    parser.add_argument('--batch-size', type=int, default=8, help="Max dynamic batch size for --backend local")
+    parser.add_argument(
+        '--micro-batch', type=int, default=1,
+        help="Pack alt_text/keywords requests for this many images into one Gemini call (1 disables)"
+    )
+    parser.add_argument('--route', action='store_true', help="Route each task to its Gemini model tier, falling back while the preferred tier is over its p95 budget")
+    parser.add_argument('--routing-config', help="JSON file of tiers and per-task routes for --route (default: built-in routes)")
+    parser.add_argument('--hedge', action='store_true', help="Duplicate requests slower than the task's rolling latency quantile; first answer wins")
+    parser.add_argument('--hedge-quantile', type=float, default=0.9, help="Rolling latency quantile after which a request is hedged")
+    parser.add_argument('--hedge-budget', type=float, default=0.05, help="Maximum hedges as a fraction of requests")
+    parser.add_argument('--api-key', default=os.getenv('GOOGLE_API_KEY'), help="Defaults to $GOOGLE_API_KEY")
+    parser.add_argument('--max-long-edge', type=int, default=PreprocessConfig.max_long_edge)
+    parser.add_argument('--upload-format', choices=['JPEG', 'WEBP'], default=PreprocessConfig.format)
+    parser.add_argument('--quality', type=int, default=PreprocessConfig.quality)
+    parser.add_argument('--max-pixels', type=int, default=PreprocessConfig.max_pixels, help="Reject larger images before decoding")
+    parser.add_argument(
+        '--max-decode-mb', type=int, default=PreprocessConfig.max_decode_bytes // 2**20,
+        help="Reject images whose decoded bitmap would exceed this many MiB"
+    )
+    parser.add_argument(
+        '--multiframe', choices=['first', 'keyframes', 'contact_sheet'], default=PreprocessConfig.multiframe,
+        help="How animated GIF/WebP inputs are sent to the model"
+    )
+    parser.add_argument('--max-keyframes', type=int, default=PreprocessConfig.max_keyframes)
+    parser.add_argument('--rpm', type=int, default=int(os.getenv('GEMINI_RPM', '60')), help="Requests per minute quota")
+    parser.add_argument('--tpm', type=int, default=int(os.getenv('GEMINI_TPM', '1000000')), help="Tokens per minute quota")
+    parser.add_argument('--dedupe-distance', type=int, default=-1, help="Reuse results for images within this dHash Hamming distance and of similar colour (default -1: off)")
+    parser.add_argument('--cache', help="SQLite file for the result cache, shared with previous runs")
+    parser.add_argument('--metrics-file', help="Write OpenMetrics text here at the end of the run")
+    parser.add_argument('--metrics-port', type=int, help="Serve OpenMetrics text at http://0.0.0.0:PORT/metrics during the run")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Seconds between throughput reports")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+    if args.backend == 'gemini' and not args.api_key:
+        logger.error("No API key: pass --api-key or set GOOGLE_API_KEY")
+        return 2
+
+    output_format = args.format or ('jsonl' if args.output.endswith('.jsonl') else 'parquet')
+    writer = JsonlResultWriter(args.output) if output_format == 'jsonl' else ParquetResultWriter(args.output)
+
+    completed = writer.completed_paths()
+    if completed:
+        logger.info("Resuming: skipping %d already completed images", len(completed))
+    paths = (path for path in iter_image_paths(args.source) if path not in completed)
+
+    preprocess = PreprocessConfig(
+        max_long_edge=args.max_long_edge,
+        format=args.upload_format,
+        quality=args.quality,
+        multiframe=args.multiframe,
+        max_keyframes=args.max_keyframes,
+        max_pixels=args.max_pixels,
+        max_decode_bytes=args.max_decode_mb * 2**20,
+    )
+    metrics = CaptionerMetrics(tracer=opentelemetry_tracer())
+    if args.metrics_port:
+        serve_metrics(metrics.registry, args.metrics_port)
+    backend = None
+    if args.backend == 'local':
+        backend = TransformersBackend.from_pretrained(args.local_model, quantize=args.quantize, max_batch_size=args.batch_size)
+    elif args.route:
+        router = ModelRouter.from_file(args.routing_config) if args.routing_config else ModelRouter()
+        backend = RoutedBackend(
+            {tier: GeminiBackend(create_gemini_model(args.api_key, spec.model_name), spec.model_name) for tier, spec in router.tiers.items()},
+            router,
+        )
+    captioner = ImageCaptioner(
+        args.api_key,
+        backend=backend,
+        cache=ResultCache(disk_path=args.cache) if args.cache else None,
+        preprocess=preprocess,
+        rate_limiter=RateLimiter(
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            max_concurrency=max(1, args.workers),
+        ),
+        dedupe_index=PerceptualIndex() if args.dedupe_distance >= 0 else None,
+        dedupe_distance=args.dedupe_distance,
+        metrics=metrics,
+        hedge=HedgePolicy(quantile=args.hedge_quantile, budget=args.hedge_budget, registry=metrics.registry) if args.hedge else None,
+        # Every image of every running micro-batch group needs its prepared parts until its last task.
+        prepared_slots=max(PREPARED_IMAGE_SLOTS, max(1, args.workers) * max(1, args.micro_batch)),
+    )
+
+    with writer:
+        reporter = run(
+            captioner,
+            paths,
+            writer,
+            args.tasks,
+            max(1, args.workers),
+            args.fused,
+            ThroughputReporter(args.report_interval),
+            args.micro_batch,
+        )
+    logger.info("Done: %s", reporter.summary())
+    throughput = captioner.backend.throughput()
+    logger.info(
+        "%s backend: %.2f images/s, %.3f images/s per core",
+        captioner.backend.name, throughput['images_per_second'], throughput['images_per_second_per_core'],
+    )
+    summary = metrics.summary()
+    logger.info(
+        "Model calls: %d (%d errors), p95 <= %gs, %d prompt / %d output tokens, %d image bytes",
+        summary['requests'], summary['errors'], summary['p95_seconds'],
+        summary['prompt_tokens'], summary['output_tokens'], summary['image_bytes'],
+    )
+    if args.metrics_file:
+        write_metrics_file(metrics.registry, args.metrics_file)
+    if captioner.batch_requests:
+        logger.info(
+            "Micro-batching: %d batch requests, %d images retried individually",
+            captioner.batch_requests, captioner.batch_retries,
+        )
+    if captioner.hedge is not None:
+        hedging = captioner.hedge.summary()
+        logger.info(
+            "Hedging: %d of %d requests hedged (%.1f%%), %.0f%% won by the hedge, p99 %.2fs -> %.2fs",
+            hedging['hedges'], hedging['requests'], hedging['hedge_rate'] * 100, hedging['hedge_win_rate'] * 100,
+            hedging['p99_primary_seconds'], hedging['p99_seconds'],
+        )
+    if isinstance(captioner.backend, RoutedBackend):
+        logger.info("Model routing: %s", json.dumps(captioner.backend.router.report()))
+    if captioner.dedupe_index is not None:
+        logger.info("Near-duplicate dedupe rate: %.1f%%", captioner.dedupe_index.dedupe_rate * 100)
+    return 1 if reporter.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+
+
+def create_gemini_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    model = genai.GenerativeModel(model_name)
+    # GenerativeModel has no public hook for a per-key client. Pinning one here gives each pooled model
+    # its own long-lived connection, independent of genai.configure calls made by other sessions.
+    model._client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+    return model
+
+
+class ClientPool:
+    """Process-wide pool of model clients keyed by (api_key, model_name), with LRU and idle eviction."""
+
+    def __init__(
+        self,
+        factory: Callable[[str, str], Any] = create_gemini_model,
+        max_size: int = 32,
+        idle_seconds: float = 1800.0,
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.created = 0
+        self.reused = 0
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str, model_name: str) -> Any:
+        key = (api_key, model_name)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.reused += 1
+                client = entry[0]
+            else:
+                self.created += 1
+                client = self.factory(api_key, model_name)
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def _evict_idle(self, now: float):
+        # Evicted clients are only dropped, not closed: a captioner built on one may still be mid-request.
+        # The underlying channel closes when its last reference is garbage collected.
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if now - last_used <= self.idle_seconds:
+                break
+            del self._clients[key]
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def stats(self) -> Tuple[int, int, int]:
+        return len(self._clients), self.created, self.reused
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from metrics import Counter, Histogram, MetricsRegistry
+
+
+def _quantile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class HedgePolicy:
+    """Fires a duplicate model call when the first has been running longer than the task's rolling latency quantile.
+
+    The first successful attempt wins. The loser is cancelled if it has not started; a synchronous SDK call
+    that is already running cannot be interrupted, so its result is discarded instead. Hedges are capped at
+    budget times the number of requests, so the extra quota spent is bounded.
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.9,
+        budget: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+        min_delay: float = 0.05,
+        max_workers: int = 32,
+        registry: Optional[MetricsRegistry] = None,
+    ):
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+        self._window = window
+        self._latencies = {}
+        # Recent end-to-end and first-attempt-only latencies over the same requests, for the tail comparison.
+        self._effective = deque(maxlen=1000)
+        self._primary = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+        self.hedged_requests = Counter(
+            'captioner_hedge_requests', "Model requests run under the hedging policy.", ('task',),
+        )
+        self.hedge_attempts = Counter(
+            'captioner_hedges', "Hedge decisions: won or lost by the duplicate, or skipped because the budget was spent or the rate limiter had no quota.",
+            ('task', 'result'),
+        )
+        self.attempt_seconds = Histogram(
+            'captioner_hedge_attempt_duration_seconds', "Latency of each successful attempt, primary or hedge.",
+            ('task', 'attempt'), unit='seconds',
+        )
+        self.request_seconds = Histogram(
+            'captioner_hedged_request_duration_seconds', "Latency of each request to its first successful attempt.",
+            ('task',), unit='seconds',
+        )
+        if registry is not None:
+            for metric in (self.hedged_requests, self.hedge_attempts, self.attempt_seconds, self.request_seconds):
+                registry.register(metric)
+
+    def threshold(self, task: Optional[str], images: int = 1) -> Optional[float]:
+        """Seconds to wait before hedging task, or None until enough latencies have been observed."""
+        with self._lock:
+            samples = self._latencies.get((task, images))
+            if not samples or len(samples) < self.min_samples:
+                return None
+            return max(self.min_delay, _quantile(samples, self.quantile))
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                self.budget_exhausted += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def _attempt(self, task: Optional[str], images: int, call: Callable[[], Any], attempt: str) -> Any:
+        started = time.perf_counter()
+        result = call()
+        seconds = time.perf_counter() - started
+        self.attempt_seconds.observe(seconds, task=task or 'all', attempt=attempt)
+        with self._lock:
+            # Keyed by image count too, so multi-image batches do not skew the single-image threshold.
+            self._latencies.setdefault((task, images), deque(maxlen=self._window)).append(seconds)
+            if attempt == 'primary':
+                self._primary.append(seconds)
+        return result
+
+    def _finish(self, task: Optional[str], started: float):
+        seconds = time.perf_counter() - started
+        self.request_seconds.observe(seconds, task=task or 'all')
+        with self._lock:
+            self._effective.append(seconds)
+
+    def _start_primary(self, task: Optional[str], images: int, call: Callable[[], Any]) -> Future:
+        # A thread of its own rather than the hedge executor, so the number of primaries in flight follows
+        # the caller's concurrency instead of being capped by the pool; only hedges share the pool.
+        future = Future()
+
+        def target():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self._attempt(task, images, call, 'primary'))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=target, name='hedge-primary', daemon=True).start()
+        return future
+
+    def run(self, task: Optional[str], call: Callable[[], Any], images: int = 1,
+            acquire: Optional[Callable[[], bool]] = None) -> Any:
+        """Return call()'s result, racing a second call() against the first once it is slower than the threshold.
+
+        call should be the bare model call: any rate limiting belongs around run(), so that limiter waits
+        and retry backoff are neither timed nor sampled. acquire, if given, is asked for quota before a hedge
+        is sent; the hedge is skipped when it returns False.
+        """
+        label = task or 'all'
+        with self._lock:
+            self.requests += 1
+        self.hedged_requests.inc(task=label)
+        started = time.perf_counter()
+
+        delay = self.threshold(task, images)
+        if delay is None:
+            # Nothing to race against yet: run on the caller's thread.
+            result = self._attempt(task, images, call, 'primary')
+            self._finish(task, started)
+            return result
+        primary = self._start_primary(task, images, call)
+        if wait([primary], timeout=delay).done:
+            result = primary.result()
+            self._finish(task, started)
+            return result
+        if not self._take_budget():
+            self.hedge_attempts.inc(task=label, result='budget_exhausted')
+            result = primary.result()
+            self._finish(task, started)
+            return result
+        if acquire is not None and not acquire():
+            with self._lock:
+                self.hedges -= 1
+            self.hedge_attempts.inc(task=label, result='rate_limited')
+            result = primary.result()
+            self._finish(task, started)
+            return result
+
+        hedge = self.executor.submit(self._attempt, task, images, call, 'hedge')
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                won = future is hedge
+                self.hedge_attempts.inc(task=label, result='won' if won else 'lost')
+                if won:
+                    with self._lock:
+                        self.hedge_wins += 1
+                self._finish(task, started)
+                return future.result()
+        raise error
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            effective, primary = list(self._effective), list(self._primary)
+            requests, hedges, wins = self.requests, self.hedges, self.hedge_wins
+        p99_primary = _quantile(primary, 0.99)
+        p99_effective = _quantile(effective, 0.99)
+        return {
+            'requests': requests,
+            'hedges': hedges,
+            'hedge_rate': hedges / requests if requests else 0.0,
+            'hedge_win_rate': wins / hedges if hedges else 0.0,
+            'budget_exhausted': self.budget_exhausted,
+            'p99_primary_seconds': p99_primary,
+            'p99_seconds': p99_effective,
+            'p99_saved_seconds': p99_primary - p99_effective,
+        }
@@ -3,17 +3,576 @@ import google.generativeai as genai
 from PIL import Image
 import io
 import base64
+import hashlib
 import os
-from typing import Optional, List
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple
+from typing_extensions import TypedDict
 
-st.set_page_config(
-    page_title="VisionCraft - AI-Powered Multimodal Image Analysis & Caption Generation",
-    page_icon="🖼️",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+from backends import CaptionBackend, GeminiBackend, TransformersBackend
+from client_pool import ClientPool, create_gemini_model
+from perceptual_hash import PerceptualIndex, colour_signature, dhash
+from image_preprocessing import ImageTooLargeError, PreparedImage, PreprocessConfig, make_preview, open_image, preprocess_image, source_bytes
+from hedging import HedgePolicy
+from keyframes import contact_sheet, frame_count, is_animated, select_keyframes
+from metrics import CaptionerMetrics, opentelemetry_tracer, serve_metrics, write_metrics_file
+from rate_limiter import RateLimiter, estimate_tokens
+from result_cache import ResultCache, image_digest, make_cache_key
+from router import ModelRouter, RoutedBackend
+from session_store import SessionResultStore
+from speculative import SpeculativeRunner
 
-st.markdown("""
+DETAILED_CAPTION_PROMPT = """
+        Analyze this image and provide a detailed, comprehensive description. 
+        Include information about:
+        - Main subjects and objects
+        - Setting and environment
+        - Colors, lighting, and mood
+        - Actions or activities happening
+        - Style or artistic elements
+        - Any text visible in the image
+        
+        Write in a natural, engaging manner as if describing the scene to someone who cannot see it.
+        """
+
+ALT_TEXT_PROMPT = """
+        Create concise, descriptive alt-text for this image that would be suitable for web accessibility.
+        The alt-text should:
+        - Be brief but informative (under 125 characters ideal)
+        - Describe the essential visual information
+        - Be useful for screen readers
+        - Avoid redundant phrases like "image of" or "picture showing"
+        - Focus on the most important elements
+        
+        Return only the alt-text, no additional explanation.
+        """
+
+KEYWORDS_PROMPT = """
+        Analyze this image and generate a list of relevant keywords and tags.
+        Include:
+        - Objects and subjects in the image
+        - Activities or actions
+        - Locations or settings
+        - Emotions or moods conveyed
+        - Colors (if significant)
+        - Style or category (e.g., portrait, landscape, abstract)
+        
+        Return the keywords as a comma-separated list, with each keyword being 1-3 words max.
+        Focus on the most relevant and searchable terms.
+        """
+
+SOCIAL_CAPTION_PROMPT = """
+        Create an engaging social media caption for this image.
+        The caption should:
+        - Be engaging and shareable
+        - Include relevant hashtags
+        - Be appropriate for platforms like Instagram or Twitter
+        - Capture the mood or story of the image
+        - Be conversational and authentic
+        
+        Keep it under 280 characters if possible.
+        """
+
+ALL_CONTENT_PROMPT = """
+Analyze this image and produce all of the following in a single JSON object:
+
+- "detailed_caption": a detailed, comprehensive description covering the main subjects and objects,
+  setting and environment, colors, lighting and mood, actions or activities, style or artistic
+  elements, and any text visible in the image. Write in a natural, engaging manner as if describing
+  the scene to someone who cannot see it.
+- "alt_text": concise, descriptive alt-text suitable for web accessibility. Under 125 characters,
+  focused on the essential visual information, without phrases like "image of" or "picture showing".
+- "keywords": a list of relevant, searchable keywords and tags (objects, activities, settings,
+  moods, significant colors, style or category), each 1-3 words long.
+- "social_caption": an engaging, authentic social media caption with relevant hashtags, suitable
+  for Instagram or Twitter, under 280 characters if possible.
+"""
+
+BATCH_PROMPT = """
+You will receive {count} images, each preceded by a label ("Image 1", "Image 2", ...).
+Apply the following instructions to each image separately:
+
+{instructions}
+
+Respond with a JSON array containing exactly one object per image, in order. Each object has the image's
+1-based "index" and its "result" as a single string.
+"""
+
+TASK_PROMPTS = {
+    'detailed_caption': DETAILED_CAPTION_PROMPT,
+    'alt_text': ALT_TEXT_PROMPT,
+    'keywords': KEYWORDS_PROMPT,
+    'social_caption': SOCIAL_CAPTION_PROMPT,
+}
+
+TASK_METHODS = {
+    'detailed_caption': 'generate_detailed_caption',
+    'alt_text': 'generate_alt_text',
+    'keywords': 'generate_keywords_and_tags',
+    'social_caption': 'generate_social_media_caption',
+}
+
+# Tasks with short outputs, where packing several images into one request does not crowd the response.
+MICRO_BATCH_TASKS = ('alt_text', 'keywords')
+
+PREPARED_IMAGE_SLOTS = 16
+
+# Display rendition sent to the browser on each rerun, instead of the decoded upload.
+PREVIEW_MAX_EDGE = int(os.getenv("CAPTIONER_PREVIEW_MAX_EDGE", "1024"))
+PREVIEW_FORMAT = os.getenv("CAPTIONER_PREVIEW_FORMAT", "JPEG")
+
+class AllContent(TypedDict):
+    detailed_caption: str
+    alt_text: str
+    keywords: List[str]
+    social_caption: str
+
+class BatchItem(TypedDict):
+    index: int
+    result: str
+
+def parse_task_output(task: str, text: str) -> Any:
+    if task == 'keywords':
+        return [tag.strip() for tag in text.split(',')][:15]
+    if task == 'alt_text':
+        return text.strip()
+    return text
+
+def parse_all_content(content: Any) -> Dict[str, Any]:
+    results = {}
+    if not isinstance(content, dict):
+        return results
+    
+    for key in ('detailed_caption', 'alt_text', 'social_caption'):
+        value = content.get(key)
+        if isinstance(value, str) and value.strip():
+            results[key] = value.strip()
+    
+    keywords = content.get('keywords')
+    if isinstance(keywords, list):
+        keywords = [tag.strip() for tag in keywords if isinstance(tag, str) and tag.strip()]
+        if keywords:
+            results['keywords'] = keywords[:15]
+    
+    return results
+
+def parse_batch_output(content: Any, count: int) -> Dict[int, str]:
+    """Map 1-based slot numbers to result text, dropping missing, duplicate, out-of-range and empty slots."""
+    results = {}
+    if not isinstance(content, list):
+        return results
+    
+    for item in content:
+        if not isinstance(item, dict):
+            continue
+        index, result = item.get('index'), item.get('result')
+        if isinstance(index, int) and 1 <= index <= count and index not in results and isinstance(result, str) and result.strip():
+            results[index] = result.strip()
+    
+    return results
+
+class ImageCaptioner:
+    def __init__(
+        self,
+        api_key: str,
+        model: Optional[Any] = None,
+        model_name: str = 'gemini-1.5-flash',
+        backend: Optional[CaptionBackend] = None,
+        max_concurrency: int = 4,
+        cache: Optional[ResultCache] = None,
+        preprocess: Optional[PreprocessConfig] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        dedupe_index: Optional[PerceptualIndex] = None,
+        dedupe_distance: int = 6,
+        metrics: Optional[CaptionerMetrics] = None,
+        hedge: Optional[HedgePolicy] = None,
+        prepared_slots: int = PREPARED_IMAGE_SLOTS,
+    ):
+        if backend is None:
+            if model is None:
+                genai.configure(api_key=api_key)
+                model = genai.GenerativeModel(model_name)
+            backend = GeminiBackend(model, model_name)
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.max_concurrency = max(1, max_concurrency)
+        self.cache = cache
+        self.preprocess = preprocess or PreprocessConfig()
+        self.rate_limiter = rate_limiter
+        self.dedupe_index = dedupe_index
+        self.dedupe_distance = dedupe_distance
+        self.metrics = metrics
+        self.hedge = hedge
+        # Callers that keep many images in flight (bulk workers x micro-batch) should size this to match,
+        # or entries are evicted before their later tasks run and get preprocessed again.
+        self.prepared_slots = max(1, prepared_slots)
+        self._prepared = OrderedDict()
+        self._preparing = {}
+        self._prepare_lock = threading.Lock()
+        self.batch_requests = 0
+        self.batch_retries = 0
+    
+    def _frames_for_upload(self, image: Image.Image) -> Tuple[List[Image.Image], str]:
+        mode = self.preprocess.multiframe
+        if mode == 'first' or not is_animated(image):
+            return [image], ''
+        
+        frames = select_keyframes(image, max_frames=self.preprocess.max_keyframes)
+        if mode == 'contact_sheet' and len(frames) > 1:
+            prefix = (
+                f"This is an animated image with {frame_count(image)} frames, shown as a contact sheet of "
+                f"{len(frames)} keyframes in reading order. Describe the animation as a whole.\n"
+            )
+            return [contact_sheet(frames)], prefix
+        prefix = (
+            f"This is an animated image with {frame_count(image)} frames, shown as {len(frames)} keyframes "
+            f"in playback order. Describe the animation as a whole.\n"
+        )
+        return frames, prefix if len(frames) > 1 else ''
+    
+    def _build_prepared_entry(self, image: Image.Image) -> Dict[str, Any]:
+        frames, prompt_prefix = self._frames_for_upload(image)
+        if self.preprocess.enabled:
+            original_bytes = source_bytes(image)
+            prepared = [preprocess_image(frame, self.preprocess, original_bytes) for frame in frames]
+            parts = [item.as_blob() for item in prepared]
+            digests = [item.digest for item in prepared]
+        else:
+            for frame in frames:
+                frame.load()
+            prepared = []
+            parts = frames
+            digests = [image_digest(frame) for frame in frames]
+        entry = {
+            'image': image,
+            'parts': parts,
+            'digest': digests[0] if len(digests) == 1 else hashlib.sha256(''.join(digests).encode()).hexdigest(),
+            'prepared': prepared,
+            'prompt_prefix': prompt_prefix,
+        }
+        if self.dedupe_index is not None:
+            entry['phash'] = dhash(image)
+            entry['colour'] = colour_signature(image)
+        return entry
+    
+    def _prepared_entry(self, image: Image.Image) -> Dict[str, Any]:
+        # Keyed by object identity; the image is kept alive alongside its entry so ids are not reused.
+        # The lock only guards the dicts: preprocessing runs outside it, once per image, so worker threads
+        # preparing different images do not wait on each other.
+        key = id(image)
+        with self._prepare_lock:
+            entry = self._prepared.get(key)
+            if entry is not None and entry['image'] is image:
+                self._prepared.move_to_end(key)
+                return entry
+            pending = self._preparing.get(key)
+            if pending is not None and pending[0] is image:
+                future, owner = pending[1], False
+            else:
+                future, owner = Future(), True
+                self._preparing[key] = (image, future)
+        if not owner:
+            return future.result()
+        
+        try:
+            entry = self._build_prepared_entry(image)
+        except BaseException as e:
+            with self._prepare_lock:
+                self._preparing.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._prepare_lock:
+            self._preparing.pop(key, None)
+            self._prepared[key] = entry
+            while len(self._prepared) > self.prepared_slots:
+                self._prepared.popitem(last=False)
+        future.set_result(entry)
+        return entry
+    
+    def prepared_entry(self, image: Image.Image) -> Dict[str, Any]:
+        """The memo entry for image (parts, digest, perceptual hash), for callers that outlive this captioner."""
+        return self._prepared_entry(image)
+    
+    def adopt_prepared(self, entry: Dict[str, Any]):
+        """Seed the memo with an entry from prepared_entry, made by a captioner with the same settings."""
+        with self._prepare_lock:
+            self._prepared[id(entry['image'])] = entry
+            self._prepared.move_to_end(id(entry['image']))
+            while len(self._prepared) > self.prepared_slots:
+                self._prepared.popitem(last=False)
+    
+    def prepare(self, image: Image.Image) -> Tuple[List[Any], str, List[PreparedImage]]:
+        """Return the content parts sent to the model for this image, their digest and per-part preprocessing stats."""
+        entry = self._prepared_entry(image)
+        return entry['parts'], entry['digest'], entry['prepared']
+    
+    def _record_lookup(self, task: Optional[str], result: str):
+        if self.metrics is not None:
+            self.metrics.record_lookup(task, self.model_name, result)
+    
+    def _lookup(self, task: Optional[str], entry: Dict[str, Any], prompt: str, generation_config=None) -> Tuple[Optional[str], Tuple]:
+        """Check the exact cache, then the near-duplicate index; also returns the keys to store under."""
+        key = variant = None
+        if self.cache is not None:
+            key = make_cache_key(entry['digest'], prompt, self.model_name, generation_config)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record_lookup(task, 'hit')
+                return cached, (key, variant)
+        
+        if self.dedupe_index is not None and 'phash' in entry:
+            variant = make_cache_key('', prompt, self.model_name, generation_config)
+            duplicate = self.dedupe_index.lookup(entry['phash'], variant, self.dedupe_distance, entry.get('colour'))
+            if duplicate is not None:
+                if key is not None:
+                    self.cache.set(key, duplicate)
+                self._record_lookup(task, 'near_duplicate')
+                return duplicate, (key, variant)
+        
+        self._record_lookup(task, 'miss')
+        return None, (key, variant)
+    
+    def _store(self, entry: Dict[str, Any], keys: Tuple, text: str):
+        key, variant = keys
+        if key is not None:
+            self.cache.set(key, text)
+        if variant is not None:
+            self.dedupe_index.add(entry['phash'], variant, text, entry.get('colour'))
+    
+    def _call_model(self, task: Optional[str], prompt: str, parts: List[Any], generation_config=None, stream: bool = False):
+        def generate():
+            return self.backend.generate(task, prompt, parts, generation_config=generation_config, stream=stream)
+        
+        def call():
+            if self.metrics is None:
+                return generate()
+            return self.metrics.instrument(task, self.backend, parts, generate, stream=stream)
+        
+        image_count = sum(not isinstance(part, str) for part in parts)
+        estimated_tokens = estimate_tokens(prompt, image_count)
+        limited = self.rate_limiter is not None and self.backend.rate_limited
+        
+        # Streams are not hedged: their first chunk is already on screen by the time a hedge would fire.
+        if self.hedge is not None and not stream:
+            # Only the model call is hedged. The limiter wraps the race, so its waits and retry backoff
+            # are not mistaken for a slow call, and a hedge is only sent if quota is free right now.
+            def hedged():
+                acquire = partial(self.rate_limiter.try_grant, estimated_tokens) if limited else None
+                return self.hedge.run(task, call, images=image_count, acquire=acquire)
+            
+            if limited:
+                return self.rate_limiter.call(hedged, estimated_tokens=estimated_tokens)
+            return hedged()
+        if limited:
+            return self.rate_limiter.call(call, estimated_tokens=estimated_tokens)
+        return call()
+    
+    def _generate(self, task: Optional[str], prompt: str, image: Image.Image, generation_config=None,
+                  parse: Optional[Callable[[str], Any]] = None) -> Any:
+        """Model text for the prompt, or parse(text) if given.
+        
+        With parse, a response is only cached once it parses, and a cached response that no longer parses
+        is treated as a miss, so a truncated reply is not replayed on every later call.
+        """
+        entry = self._prepared_entry(image)
+        prompt = entry['prompt_prefix'] + prompt
+        text, keys = self._lookup(task, entry, prompt, generation_config)
+        if text is not None:
+            if parse is None:
+                return text
+            try:
+                return parse(text)
+            except ValueError:
+                # Cached before responses were validated; regenerate it below.
+                pass
+        
+        text = self._call_model(task, prompt, entry['parts'], generation_config).text
+        result = text if parse is None else parse(text)
+        self._store(entry, keys, text)
+        return result
+    
+    def stream_task(self, task: str, image: Image.Image, timings: Optional[Dict[str, float]] = None) -> Iterator[str]:
+        """Yield a task's raw text as it is generated, recording time to first token and total latency."""
+        timings = {} if timings is None else timings
+        started = time.perf_counter()
+        entry = self._prepared_entry(image)
+        prompt = entry['prompt_prefix'] + TASK_PROMPTS[task]
+        text, keys = self._lookup(task, entry, prompt)
+        if text is not None:
+            timings['time_to_first_token'] = timings['total'] = time.perf_counter() - started
+            timings['cached'] = True
+            yield text
+            return
+        
+        if not self.backend.supports_streaming:
+            text = self._call_model(task, prompt, entry['parts']).text
+            timings['time_to_first_token'] = timings['total'] = time.perf_counter() - started
+            timings['cached'] = False
+            self._store(entry, keys, text)
+            yield text
+            return
+        
+        chunks = []
+        for chunk in self._call_model(task, prompt, entry['parts'], stream=True):
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish-reason chunk) have nothing to render.
+                continue
+            if not chunk_text:
+                continue
+            if not chunks:
+                timings['time_to_first_token'] = time.perf_counter() - started
+            chunks.append(chunk_text)
+            yield chunk_text
+        
+        timings['total'] = time.perf_counter() - started
+        timings['cached'] = False
+        if chunks:
+            self._store(entry, keys, ''.join(chunks))
+    
+    def run_task(self, task: str, image: Image.Image) -> Any:
+        """Run one task prompt and parse its output, raising on model errors."""
+        return parse_task_output(task, self._generate(task, TASK_PROMPTS[task], image))
+    
+    def generate_detailed_caption(self, image: Image.Image) -> str:
+        try:
+            return self.run_task('detailed_caption', image)
+        except Exception as e:
+            return f"Error generating caption: {str(e)}"
+    
+    def generate_alt_text(self, image: Image.Image) -> str:
+        try:
+            return self.run_task('alt_text', image)
+        except Exception as e:
+            return f"Error generating alt-text: {str(e)}"
+    
+    def generate_keywords_and_tags(self, image: Image.Image) -> List[str]:
+        try:
+            return self.run_task('keywords', image)
+        except Exception as e:
+            return [f"Error generating tags: {str(e)}"]
+    
+    def generate_social_media_caption(self, image: Image.Image) -> str:
+        try:
+            return self.run_task('social_caption', image)
+        except Exception as e:
+            return f"Error generating social media caption: {str(e)}"
+    
+    def generate_all_structured(self, image: Image.Image) -> Dict[str, Any]:
+        """Request all four outputs as one JSON object, returning only the fields that parsed."""
+        if not self.backend.supports_structured_output:
+            raise NotImplementedError(f"The {self.backend.name} backend does not support structured output")
+        return self._generate(
+            None,
+            ALL_CONTENT_PROMPT,
+            image,
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=AllContent,
+            ),
+            parse=lambda text: parse_all_content(json.loads(text)),
+        )
+    
+    def generate_all(self, image: Image.Image) -> Dict[str, Any]:
+        """Generate all four outputs from one structured request, falling back per field."""
+        try:
+            results = self.generate_all_structured(image)
+        except Exception:
+            results = {}
+        
+        missing = [task for task in TASK_METHODS if task not in results]
+        for task, value in self.generate_concurrently(image, missing):
+            results[task] = value
+        
+        return {task: results[task] for task in TASK_METHODS}
+    
+    def _request_batch(self, task: str, chunk: List[Tuple[int, Dict[str, Any], Tuple]]) -> Dict[int, str]:
+        contents = []
+        for slot, (_, entry, _) in enumerate(chunk, 1):
+            contents.append(f"Image {slot}:")
+            contents.extend(entry['parts'])
+        
+        response = self._call_model(
+            task,
+            BATCH_PROMPT.format(count=len(chunk), instructions=TASK_PROMPTS[task].strip()),
+            contents,
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                # The SDK only understands the builtin list[...] form here, not typing.List.
+                response_schema=list[BatchItem],
+            ),
+        )
+        self.batch_requests += 1
+        return parse_batch_output(json.loads(response.text), len(chunk))
+    
+    def generate_batch(self, task: str, images: List[Image.Image], batch_size: int = 8) -> List[Any]:
+        """Run one task over many images, packing up to batch_size images into each request.
+        
+        Cached images are answered locally. Slots that are missing or malformed in a batch response are
+        retried one image at a time; a slot whose retry also fails holds the exception instead of a result.
+        """
+        results = [None] * len(images)
+        resolved = set()
+        batchable = []
+        for position, image in enumerate(images):
+            entry = self._prepared_entry(image)
+            text, keys = self._lookup(task, entry, entry['prompt_prefix'] + TASK_PROMPTS[task])
+            if text is not None:
+                results[position] = parse_task_output(task, text)
+                resolved.add(position)
+            elif len(entry['parts']) == 1 and not entry['prompt_prefix']:
+                batchable.append((position, entry, keys))
+        
+        chunks = []
+        if batch_size > 1 and self.backend.supports_structured_output:
+            chunks = [batchable[start:start + batch_size] for start in range(0, len(batchable), batch_size)]
+            chunks = [chunk for chunk in chunks if len(chunk) > 1]
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self._request_batch, task, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    answers = future.result()
+                except Exception:
+                    answers = {}
+                for slot, (position, entry, keys) in enumerate(futures[future], 1):
+                    if slot in answers:
+                        self._store(entry, keys, answers[slot])
+                        results[position] = parse_task_output(task, answers[slot])
+                        resolved.add(position)
+            
+            retries = [position for position in range(len(images)) if position not in resolved]
+            self.batch_retries += sum(1 for chunk in chunks for position, _, _ in chunk if position not in resolved)
+            futures = {executor.submit(self.run_task, task, images[position]): position for position in retries}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+        
+        return results
+    
+    def generate_concurrently(self, image: Image.Image, tasks: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, Any]]:
+        """Run separate task prompts on a bounded thread pool, yielding (task, result) as each finishes."""
+        tasks = list(TASK_METHODS if tasks is None else tasks)
+        if not tasks:
+            return
+        
+        # Prepare once up front so worker threads share the encoded upload.
+        self.prepare(image)
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(tasks))) as executor:
+            futures = {executor.submit(getattr(self, TASK_METHODS[task]), image): task for task in tasks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+PAGE_STYLE = """
 <style>
     .main-header {
         text-align: center;
@@ -70,105 +629,199 @@ st.markdown("""
         margin: 2rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
-class ImageCaptioner:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    def generate_detailed_caption(self, image: Image.Image) -> str:
-        prompt = """
-        Analyze this image and provide a detailed, comprehensive description. 
-        Include information about:
-        - Main subjects and objects
-        - Setting and environment
-        - Colors, lighting, and mood
-        - Actions or activities happening
-        - Style or artistic elements
-        - Any text visible in the image
-        
-        Write in a natural, engaging manner as if describing the scene to someone who cannot see it.
-        """
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            return f"Error generating caption: {str(e)}"
-    
-    def generate_alt_text(self, image: Image.Image) -> str:
-        prompt = """
-        Create concise, descriptive alt-text for this image that would be suitable for web accessibility.
-        The alt-text should:
-        - Be brief but informative (under 125 characters ideal)
-        - Describe the essential visual information
-        - Be useful for screen readers
-        - Avoid redundant phrases like "image of" or "picture showing"
-        - Focus on the most important elements
-        
-        Return only the alt-text, no additional explanation.
-        """
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text.strip()
-        except Exception as e:
-            return f"Error generating alt-text: {str(e)}"
-    
-    def generate_keywords_and_tags(self, image: Image.Image) -> List[str]:
-        prompt = """
-        Analyze this image and generate a list of relevant keywords and tags.
-        Include:
-        - Objects and subjects in the image
-        - Activities or actions
-        - Locations or settings
-        - Emotions or moods conveyed
-        - Colors (if significant)
-        - Style or category (e.g., portrait, landscape, abstract)
-        
-        Return the keywords as a comma-separated list, with each keyword being 1-3 words max.
-        Focus on the most relevant and searchable terms.
-        """
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            keywords = [tag.strip() for tag in response.text.split(',')]
-            return keywords[:15] 
-        except Exception as e:
-            return [f"Error generating tags: {str(e)}"]
-    
-    def generate_social_media_caption(self, image: Image.Image) -> str:
-        prompt = """
-        Create an engaging social media caption for this image.
-        The caption should:
-        - Be engaging and shareable
-        - Include relevant hashtags
-        - Be appropriate for platforms like Instagram or Twitter
-        - Capture the mood or story of the image
-        - Be conversational and authentic
-        
-        Keep it under 280 characters if possible.
-        """
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            return f"Error generating social media caption: {str(e)}"
+@st.cache_resource
+def _rate_limiter_for_key(api_key: str) -> RateLimiter:
+    return RateLimiter()
+
+def get_rate_limiter(api_key: str, requests_per_minute: int, tokens_per_minute: int) -> RateLimiter:
+    # One limiter per API key, shared by every session in this process. The quota is not part of the cache
+    # key: changing it updates that limiter instead of starting a second one for the same key.
+    rate_limiter = _rate_limiter_for_key(api_key)
+    rate_limiter.set_quota(requests_per_minute, tokens_per_minute)
+    return rate_limiter
+
+@st.cache_resource
+def get_dedupe_index() -> PerceptualIndex:
+    return PerceptualIndex()
+
+@st.cache_resource
+def get_metrics() -> CaptionerMetrics:
+    # Process-wide, like the limiter: every session's model calls land in one exposition.
+    metrics = CaptionerMetrics(tracer=opentelemetry_tracer())
+    port = os.getenv("CAPTIONER_METRICS_PORT")
+    if port:
+        serve_metrics(metrics.registry, int(port))
+    return metrics
+
+@st.cache_resource
+def get_hedge_policy(quantile: float, budget: float) -> HedgePolicy:
+    # Process-wide, like the metrics it registers into: latency windows are per model, not per session.
+    return HedgePolicy(quantile=quantile, budget=budget, registry=get_metrics().registry)
+
+def get_session_results() -> SessionResultStore:
+    # Per session, unlike the cache_resource objects above, and bounded so long-lived tabs stay small.
+    if 'results' not in st.session_state:
+        st.session_state.results = SessionResultStore(
+            max_images=int(os.getenv("CAPTIONER_SESSION_MAX_IMAGES", "8")),
+            max_bytes=int(os.getenv("CAPTIONER_SESSION_MAX_BYTES", "1000000")),
+        )
+    return st.session_state.results
+
+@st.cache_resource
+def get_speculation_executor() -> ThreadPoolExecutor:
+    # Shared by all sessions; each session has at most one speculation queued or running.
+    return ThreadPoolExecutor(max_workers=int(os.getenv("CAPTIONER_SPECULATION_WORKERS", "4")), thread_name_prefix="speculative")
+
+def get_speculation() -> SpeculativeRunner:
+    if 'speculation' not in st.session_state:
+        st.session_state.speculation = SpeculativeRunner(get_speculation_executor())
+    return st.session_state.speculation
+
+def speculate(captioner: ImageCaptioner, task: str, data: bytes, preprocess: PreprocessConfig) -> Any:
+    # Decodes its own copy so the background thread never shares a PIL image with the script thread.
+    image, _ = open_image(io.BytesIO(data), preprocess)
+    with image:
+        return captioner.run_task(task, image)
+
+def take_speculative(speculation: SpeculativeRunner, store: SessionResultStore, digest: str, task: str) -> bool:
+    """Store the speculative result for task if there is one, waiting for it if it is still running."""
+    started = time.perf_counter()
+    value = speculation.take(digest, task)
+    if value is None:
+        return False
+    store.set(digest, task, value)
+    record_latency(store, digest, task, total=time.perf_counter() - started, speculative=True)
+    return True
+
+def upload_digest(uploaded_file) -> str:
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def upload_preview(digest: str, _image: Image.Image, max_edge: int, image_format: str) -> bytes:
+    # Keyed by digest; the underscore keeps Streamlit from hashing the decoded image itself.
+    return make_preview(_image, max_edge, image_format)
+
+def load_upload(uploaded_file, digest: str, preprocess: PreprocessConfig, captioner: ImageCaptioner) -> Dict[str, Any]:
+    """The decoded upload, its prepared model parts and its details, computed once per image and settings in this session.
+
+    Button clicks rerun the script and build a new captioner; the stored entry is handed to it, so the
+    upload is not decoded or preprocessed again.
+    """
+    # The perceptual hash is only computed when near-duplicate reuse is on, so it is part of the settings.
+    config = repr((preprocess, captioner.dedupe_index is not None))
+    upload = st.session_state.get('upload')
+    if upload is not None and upload['digest'] == digest and upload['config'] == config:
+        captioner.adopt_prepared(upload['prepared'])
+        return upload
+    st.session_state.pop('upload', None)
+    image, original_size = open_image(uploaded_file, preprocess)
+    details = {
+        'format': image.format,
+        'original_size': original_size,
+        'decoded_size': image.size,
+        'mode': image.mode,
+        'file_size': getattr(uploaded_file, 'size', None),
+        'frames': frame_count(image) if is_animated(image) else None,
+    }
+    entry = captioner.prepared_entry(image)
+    prepared = entry['prepared']
+    details['parts_sent'] = len(entry['parts'])
+    if prepared:
+        original_bytes = details['file_size'] or prepared[0].original_bytes
+        details['sent'] = {
+            'size': prepared[0].size,
+            'mime_type': prepared[0].mime_type,
+            'bytes': sum(len(item.data) for item in prepared),
+            'original_bytes': original_bytes,
+        }
+    upload = {'digest': digest, 'config': config, 'image': image, 'prepared': entry, 'details': details}
+    st.session_state.upload = upload
+    return upload
+
+def record_latency(store: SessionResultStore, digest: str, task: str, **timings: float):
+    store.set_latency(digest, task, timings)
+
+def show_latency(store: SessionResultStore, digest: str, task: str):
+    timings = store.latency(digest, task)
+    if not timings:
+        return
+    parts = []
+    if 'time_to_first_token' in timings:
+        parts.append(f"first token {timings['time_to_first_token']:.2f}s")
+    if 'total' in timings:
+        parts.append(f"total {timings['total']:.2f}s")
+    if timings.get('cached'):
+        parts.append("from cache")
+    if timings.get('speculative'):
+        parts.append("precomputed after upload")
+    st.caption("⏱️ " + " · ".join(parts))
+
+def stream_result(captioner: ImageCaptioner, task: str, image: Image.Image, store: SessionResultStore, digest: str) -> str:
+    timings = {}
+    try:
+        text = st.write_stream(captioner.stream_task(task, image, timings))
+        if not isinstance(text, str):
+            text = ''.join(str(chunk) for chunk in text)
+    except Exception as e:
+        text = f"Error generating {task.replace('_', ' ')}: {str(e)}"
+        st.write(text)
+    record_latency(store, digest, task, **timings)
+    return text
+
+def configure_page():
+    st.set_page_config(
+        page_title="VisionCraft - AI-Powered Multimodal Image Analysis & Caption Generation",
+        page_icon="🖼️",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(PAGE_STYLE, unsafe_allow_html=True)
+
+@st.cache_resource
+def get_client_pool() -> ClientPool:
+    return ClientPool(factory=lambda api_key, model_name: GeminiBackend(create_gemini_model(api_key, model_name), model_name))
+
+@st.cache_resource(show_spinner="Loading local captioning model...")
+def get_local_backend(model_name: str, quantize: bool, max_batch_size: int) -> TransformersBackend:
+    return TransformersBackend.from_pretrained(model_name, quantize=quantize, max_batch_size=max_batch_size)
+
+@st.cache_resource
+def get_model_router() -> ModelRouter:
+    # Process-wide: tier latency is a property of the models, not of one session.
+    config_path = os.getenv("CAPTIONER_ROUTING_CONFIG")
+    return ModelRouter.from_file(config_path) if config_path else ModelRouter()
+
+@st.cache_resource
+def get_result_cache(disk_path: Optional[str] = None) -> ResultCache:
+    return ResultCache(disk_path=disk_path)
 
 def main():
+    configure_page()
     st.markdown('<h1 class="main-header">VisionCraft - AI-Powered Multimodal Image Analysis & Caption Generation</h1>', unsafe_allow_html=True)
     
     st.sidebar.header("🔧 Configuration")
     
+    backend_choice = st.sidebar.selectbox(
+        "Captioning backend",
+        ["Gemini (gemini-1.5-flash)", "Local CPU (transformers)"],
+        help="The local backend runs an image-to-text model on this machine at zero API cost"
+    )
+    use_local_backend = backend_choice.startswith("Local")
+    
     api_key = st.sidebar.text_input(
         "Enter your Google Gemini API Key:",
         type="password",
-        help="Get your API key from https://makersuite.google.com/app/apikey"
+        help="Get your API key from https://makersuite.google.com/app/apikey",
+        disabled=use_local_backend
     )
     
-    if not api_key:
+    if use_local_backend:
+        local_model_name = st.sidebar.text_input("Local model", value="nlpconnect/vit-gpt2-image-captioning")
+        local_quantize = st.sidebar.checkbox("int8 dynamic quantization", value=True)
+        local_batch_size = st.sidebar.slider("Max batch size", min_value=1, max_value=32, value=8)
+    elif not api_key:
         st.sidebar.warning(" Please enter your Gemini API key to use the application.")
         st.info("""
         ##  Getting Started
@@ -185,9 +838,142 @@ def main():
         """)
         return
     
+    st.sidebar.subheader("⚡ Performance")
+    fused_generation = st.sidebar.checkbox(
+        "Single request for Generate All",
+        value=True,
+        help="Ask for all four outputs in one structured request instead of four separate prompts"
+    )
+    max_concurrency = st.sidebar.slider(
+        "Max concurrent requests",
+        min_value=1,
+        max_value=len(TASK_METHODS),
+        value=len(TASK_METHODS),
+        help="Upper bound on parallel Gemini calls per session"
+    )
+    speculative_tasks = {'Off': None, 'Alt-Text': 'alt_text', 'Keywords & Tags': 'keywords'}
+    speculative_task = speculative_tasks[st.sidebar.selectbox(
+        "Speculate after upload",
+        list(speculative_tasks),
+        help="Start this task in the background as soon as an image is uploaded, so its button answers immediately"
+    )]
+    speculation = get_speculation()
+    speculation_stats = st.sidebar.empty()
+    hedge_requests = st.sidebar.checkbox(
+        "Hedge slow requests",
+        value=False,
+        disabled=use_local_backend,
+        help="Send a duplicate request when one is slower than the task's recent p90, and use whichever answers first"
+    ) and not use_local_backend
+    hedge_stats = st.sidebar.empty()
+    route_models = st.sidebar.checkbox(
+        "Route tasks across model tiers",
+        value=False,
+        disabled=use_local_backend,
+        help="Send each task to its configured Gemini tier, falling back to a faster one while the preferred tier's p95 latency is over the task's budget"
+    ) and not use_local_backend
+    
+    stream_output = st.sidebar.checkbox(
+        "Stream long captions",
+        value=True,
+        help="Render detailed and social captions token by token as they are generated"
+    )
+    
+    persist_cache = st.sidebar.checkbox(
+        "Persist result cache to disk",
+        value=False,
+        help="Keep generated results across restarts in a local SQLite file"
+    )
+    cache_path = os.path.join(os.getenv("CAPTIONER_CACHE_DIR", ".captioner_cache"), "results.sqlite")
+    result_cache = get_result_cache(cache_path if persist_cache else None)
+    cache_stats = st.sidebar.empty()
+    
+    reuse_duplicates = st.sidebar.checkbox(
+        "Reuse results for near-duplicates",
+        value=False,
+        help="Serve resized, re-compressed or slightly cropped copies of already captioned images from a perceptual-hash index. "
+             "Matches must also agree in coarse colour, but similar products can still share a caption, so this is off by default."
+    )
+    dedupe_distance = st.sidebar.slider(
+        "Near-duplicate distance (bits)",
+        min_value=0,
+        max_value=16,
+        value=6,
+        disabled=not reuse_duplicates,
+        help="Maximum Hamming distance between 64-bit dHashes to treat two images as the same"
+    )
+    dedupe_index = get_dedupe_index()
+    dedupe_stats = st.sidebar.empty()
+    
+    optimize_uploads = st.sidebar.checkbox(
+        "Optimize images before upload",
+        value=True,
+        help="Apply EXIF orientation, strip metadata, downscale and re-encode before sending to Gemini"
+    )
+    preprocess = PreprocessConfig(enabled=optimize_uploads)
+    preprocess.max_pixels = int(os.getenv("CAPTIONER_MAX_PIXELS", preprocess.max_pixels))
+    preprocess.max_decode_bytes = int(os.getenv("CAPTIONER_MAX_DECODE_MB", preprocess.max_decode_bytes // 2**20)) * 2**20
+    if optimize_uploads:
+        preprocess.max_long_edge = st.sidebar.select_slider(
+            "Max long edge (px)",
+            options=[512, 768, 1024, 1536, 2048, 3072],
+            value=preprocess.max_long_edge
+        )
+        preprocess.format = st.sidebar.selectbox("Upload format", ['JPEG', 'WEBP'])
+        preprocess.quality = st.sidebar.slider("Upload quality", min_value=50, max_value=95, value=preprocess.quality)
+    multiframe_modes = {'First frame only': 'first', 'Keyframes': 'keyframes', 'Contact sheet': 'contact_sheet'}
+    preprocess.multiframe = multiframe_modes[st.sidebar.selectbox(
+        "Animated images",
+        list(multiframe_modes),
+        help="How animated GIF/WebP uploads are sent: the first frame, scene-change keyframes, or one tiled sheet of them"
+    )]
+    if preprocess.multiframe != 'first':
+        preprocess.max_keyframes = st.sidebar.slider("Max keyframes", min_value=2, max_value=8, value=preprocess.max_keyframes)
+    
+    requests_per_minute = st.sidebar.number_input(
+        "Requests per minute",
+        min_value=1,
+        value=int(os.getenv("GEMINI_RPM", "60")),
+        help="Shared client-side limit for this API key; retries back off on 429 and 5xx errors"
+    )
+    tokens_per_minute = st.sidebar.number_input(
+        "Tokens per minute",
+        min_value=1000,
+        value=int(os.getenv("GEMINI_TPM", "1000000")),
+        step=1000
+    )
+    rate_limiter = get_rate_limiter(api_key, requests_per_minute, tokens_per_minute)
+    limiter_stats = st.sidebar.empty()
+    metrics = get_metrics()
+    metrics_stats = st.sidebar.empty()
+    
     try:
-        captioner = ImageCaptioner(api_key)
-        st.sidebar.success("✅ API key configured successfully!")
+        if use_local_backend:
+            backend = get_local_backend(local_model_name, local_quantize, local_batch_size)
+        elif route_models:
+            router = get_model_router()
+            backend = RoutedBackend(
+                {tier: get_client_pool().get(api_key, spec.model_name) for tier, spec in router.tiers.items()},
+                router
+            )
+        else:
+            backend = get_client_pool().get(api_key, 'gemini-1.5-flash')
+        captioner = ImageCaptioner(
+            api_key,
+            backend=backend,
+            max_concurrency=max_concurrency,
+            cache=result_cache,
+            preprocess=preprocess,
+            rate_limiter=rate_limiter,
+            dedupe_index=dedupe_index if reuse_duplicates else None,
+            dedupe_distance=dedupe_distance,
+            metrics=metrics,
+            hedge=get_hedge_policy(
+                float(os.getenv("CAPTIONER_HEDGE_QUANTILE", "0.9")),
+                float(os.getenv("CAPTIONER_HEDGE_BUDGET", "0.05"))
+            ) if hedge_requests else None
+        )
+        st.sidebar.success("✅ Local model loaded!" if use_local_backend else "✅ API key configured successfully!")
     except Exception as e:
         st.sidebar.error(f"❌ Error configuring API: {str(e)}")
         return
@@ -205,83 +991,132 @@ def main():
     
     if uploaded_file is not None:
         try:
-            image = Image.open(uploaded_file)
+            store = get_session_results()
+            digest = upload_digest(uploaded_file)
+            upload = load_upload(uploaded_file, digest, preprocess, captioner)
+            image = upload['image']
+            details = upload['details']
+            if speculative_task and speculative_task not in store.results(digest):
+                speculation.start(digest, speculative_task, partial(speculate, captioner, speculative_task, uploaded_file.getvalue(), preprocess))
+            elif not speculative_task:
+                speculation.cancel()
             
             col1, col2 = st.columns([2, 1])
             
             with col1:
-                st.image(image, caption="Uploaded Image", use_container_width=True)
+                preview = upload_preview(digest, image, PREVIEW_MAX_EDGE, PREVIEW_FORMAT)
+                st.image(preview, caption="Uploaded Image", use_container_width=True)
             
             with col2:
                 st.markdown("### 📊 Image Details")
-                st.write(f"**Format:** {image.format}")
-                st.write(f"**Size:** {image.size[0]} × {image.size[1]} pixels")
-                st.write(f"**Mode:** {image.mode}")
-                if hasattr(uploaded_file, 'size'):
-                    st.write(f"**File Size:** {uploaded_file.size:,} bytes")
+                original_size, decoded_size = details['original_size'], details['decoded_size']
+                st.write(f"**Format:** {details['format']}")
+                st.write(f"**Size:** {original_size[0]} × {original_size[1]} pixels")
+                if decoded_size != original_size:
+                    st.write(f"**Decoded At:** {decoded_size[0]} × {decoded_size[1]} pixels")
+                st.write(f"**Mode:** {details['mode']}")
+                if details['file_size'] is not None:
+                    st.write(f"**File Size:** {details['file_size']:,} bytes")
+                
+                if details['frames']:
+                    st.write(f"**Frames:** {details['frames']}")
+                
+                if details['parts_sent'] > 1:
+                    st.write(f"**Keyframes Sent:** {details['parts_sent']}")
+                sent = details.get('sent')
+                if sent:
+                    saved = max(0, sent['original_bytes'] - sent['bytes'])
+                    st.write(f"**Sent to Model:** {sent['size'][0]} × {sent['size'][1]} {sent['mime_type']}, {sent['bytes']:,} bytes")
+                    st.write(f"**Bytes Saved:** {saved:,} ({saved / max(sent['original_bytes'], 1):.0%})")
             
             st.markdown("### 🎯 Generate Content")
             
             col1, col2, col3, col4 = st.columns(4)
             
+            streaming_task = None
+            
             with col1:
                 if st.button("📝 Detailed Caption", use_container_width=True):
-                    with st.spinner("Generating detailed caption..."):
-                        caption = captioner.generate_detailed_caption(image)
-                        st.session_state.detailed_caption = caption
+                    if stream_output:
+                        streaming_task = 'detailed_caption'
+                    else:
+                        with st.spinner("Generating detailed caption..."):
+                            started = time.perf_counter()
+                            caption = captioner.generate_detailed_caption(image)
+                            store.set(digest, 'detailed_caption', caption)
+                            record_latency(store, digest, 'detailed_caption', total=time.perf_counter() - started)
             
             with col2:
                 if st.button("🔤 Alt-Text", use_container_width=True):
                     with st.spinner("Generating alt-text..."):
-                        alt_text = captioner.generate_alt_text(image)
-                        st.session_state.alt_text = alt_text
+                        if not take_speculative(speculation, store, digest, 'alt_text'):
+                            alt_text = captioner.generate_alt_text(image)
+                            store.set(digest, 'alt_text', alt_text)
             
             with col3:
                 if st.button("🏷️ Keywords & Tags", use_container_width=True):
                     with st.spinner("Generating keywords..."):
-                        keywords = captioner.generate_keywords_and_tags(image)
-                        st.session_state.keywords = keywords
+                        if not take_speculative(speculation, store, digest, 'keywords'):
+                            keywords = captioner.generate_keywords_and_tags(image)
+                            store.set(digest, 'keywords', keywords)
             
             with col4:
                 if st.button("📱 Social Caption", use_container_width=True):
-                    with st.spinner("Generating social media caption..."):
-                        social_caption = captioner.generate_social_media_caption(image)
-                        st.session_state.social_caption = social_caption
+                    if stream_output:
+                        streaming_task = 'social_caption'
+                    else:
+                        with st.spinner("Generating social media caption..."):
+                            started = time.perf_counter()
+                            social_caption = captioner.generate_social_media_caption(image)
+                            store.set(digest, 'social_caption', social_caption)
+                            record_latency(store, digest, 'social_caption', total=time.perf_counter() - started)
             
             st.markdown("### 📋 Results")
             
-            if 'detailed_caption' in st.session_state:
+            results = store.results(digest)
+            
+            if streaming_task == 'detailed_caption' or 'detailed_caption' in results:
                 st.markdown('<div class="result-container">', unsafe_allow_html=True)
                 st.markdown("#### 📝 Detailed Description")
-                st.write(st.session_state.detailed_caption)
+                if streaming_task == 'detailed_caption':
+                    store.set(digest, 'detailed_caption', stream_result(captioner, 'detailed_caption', image, store, digest))
+                else:
+                    st.write(results['detailed_caption'])
+                show_latency(store, digest, 'detailed_caption')
                 st.markdown('</div>', unsafe_allow_html=True)
             
-            if 'alt_text' in st.session_state:
+            if 'alt_text' in results:
                 st.markdown('<div class="result-container">', unsafe_allow_html=True)
                 st.markdown("#### 🔤 Alt-Text (Web Accessibility)")
-                st.code(st.session_state.alt_text, language=None)
+                st.code(results['alt_text'], language=None)
+                show_latency(store, digest, 'alt_text')
                 st.markdown('</div>', unsafe_allow_html=True)
             
-            if 'keywords' in st.session_state:
+            if 'keywords' in results:
                 st.markdown('<div class="result-container">', unsafe_allow_html=True)
                 st.markdown("#### 🏷️ Keywords & Tags")
                 
                 tag_html = '<div class="tag-container">'
-                for keyword in st.session_state.keywords:
+                for keyword in results['keywords']:
                     tag_html += f'<span class="tag">{keyword.strip()}</span>'
                 tag_html += '</div>'
                 st.markdown(tag_html, unsafe_allow_html=True)
                 
-                st.text_area("Copy Keywords:", ", ".join(st.session_state.keywords), height=100)
+                st.text_area("Copy Keywords:", ", ".join(results['keywords']), height=100)
+                show_latency(store, digest, 'keywords')
                 st.markdown('</div>', unsafe_allow_html=True)
             
-            if 'social_caption' in st.session_state:
+            if streaming_task == 'social_caption' or 'social_caption' in results:
                 st.markdown('<div class="result-container">', unsafe_allow_html=True)
                 st.markdown("#### 📱 Social Media Caption")
-                st.write(st.session_state.social_caption)
+                if streaming_task == 'social_caption':
+                    store.set(digest, 'social_caption', stream_result(captioner, 'social_caption', image, store, digest))
+                else:
+                    st.write(results['social_caption'])
+                show_latency(store, digest, 'social_caption')
                 st.markdown('</div>', unsafe_allow_html=True)
             
-            if any(key in st.session_state for key in ['detailed_caption', 'alt_text', 'keywords', 'social_caption']):
+            if store.results(digest):
                 st.markdown("### ⚡ Quick Actions")
                 col1, col2 = st.columns(2)
                 
@@ -290,30 +1125,86 @@ def main():
                         with st.spinner("Generating all content..."):
                             progress_bar = st.progress(0)
                             
-                            st.session_state.detailed_caption = captioner.generate_detailed_caption(image)
-                            progress_bar.progress(25)
-                            
-                            st.session_state.alt_text = captioner.generate_alt_text(image)
-                            progress_bar.progress(50)
-                            
-                            st.session_state.keywords = captioner.generate_keywords_and_tags(image)
-                            progress_bar.progress(75)
-                            
-                            st.session_state.social_caption = captioner.generate_social_media_caption(image)
-                            progress_bar.progress(100)
+                            if fused_generation:
+                                store.update(digest, captioner.generate_all(image))
+                                progress_bar.progress(100)
+                            else:
+                                generated = captioner.generate_concurrently(image)
+                                for done, (key, value) in enumerate(generated, start=1):
+                                    store.set(digest, key, value)
+                                    progress_bar.progress(int(done / len(TASK_METHODS) * 100))
                             
                             st.success("✅ All content generated successfully!")
                 
                 with col2:
                     if st.button("🗑️ Clear All Results", use_container_width=True):
-                        for key in ['detailed_caption', 'alt_text', 'keywords', 'social_caption']:
-                            if key in st.session_state:
-                                del st.session_state[key]
+                        store.clear(digest)
                         st.success("🧹 All results cleared!")
                         st.rerun()
             
+        except ImageTooLargeError as e:
+            st.error(f"❌ Image too large: {str(e)} Please upload a smaller image.")
         except Exception as e:
             st.error(f"❌ Error processing image: {str(e)}")
+    else:
+        speculation.cancel()
+        st.session_state.pop('upload', None)
+    
+    cache_stats.caption(
+        f"🗄️ Cache: {result_cache.hits} hits · {result_cache.misses} misses "
+        f"({result_cache.hit_rate:.0%} hit rate)"
+    )
+    dedupe_stats.caption(
+        f"🔁 Dedupe: {dedupe_index.hits}/{dedupe_index.lookups} lookups served from near-duplicates "
+        f"({dedupe_index.dedupe_rate:.0%}) · {len(dedupe_index)} images indexed"
+    )
+    throughput = captioner.backend.throughput()
+    st.sidebar.caption(
+        f"⚙️ {captioner.backend.name} ({captioner.model_name}): {throughput['images']} images · "
+        f"{throughput['images_per_second']:.2f} images/s · "
+        f"{throughput['images_per_second_per_core']:.3f} images/s per core"
+    )
+    limiter_stats.caption(
+        f"🚦 Limiter: {rate_limiter.retries} retries · {rate_limiter.quota_errors} quota errors · "
+        f"concurrency {int(rate_limiter.concurrency_limit)}/{rate_limiter.max_concurrency}"
+    )
+    if speculative_task or speculation.started:
+        spec = speculation.stats()
+        speculation_stats.caption(
+            f"🔮 Speculation: {spec['used']}/{spec['started']} results used ({spec['usage_rate']:.0%}) · "
+            f"{spec['discarded']} discarded · {spec['failed']} failed"
+        )
+    session_results = get_session_results()
+    st.sidebar.caption(
+        f"🧠 Session results: {len(session_results)}/{session_results.max_images} images · "
+        f"{session_results.total_bytes / 1024:.0f}/{session_results.max_bytes / 1024:.0f} KB"
+    )
+    summary = metrics.summary()
+    metrics_stats.caption(
+        f"📈 Model calls: {summary['requests']:.0f} · {summary['errors']:.0f} errors · "
+        f"p50 ≤ {summary['p50_seconds']:g}s · p95 ≤ {summary['p95_seconds']:g}s · "
+        f"{summary['prompt_tokens']:.0f} prompt / {summary['output_tokens']:.0f} output tokens"
+    )
+    if captioner.hedge is not None:
+        hedging = captioner.hedge.summary()
+        hedge_stats.caption(
+            f"🪃 Hedging: {hedging['hedge_rate']:.1%} of {hedging['requests']} requests hedged · "
+            f"{hedging['hedge_win_rate']:.0%} won by the hedge · "
+            f"p99 {hedging['p99_primary_seconds']:.2f}s → {hedging['p99_seconds']:.2f}s"
+        )
+    if route_models:
+        with st.sidebar.expander("🧭 Model routing"):
+            for task, row in get_model_router().report().items():
+                tiers = ", ".join(
+                    f"{tier} ×{stats['requests']} (p95 {stats['p95_seconds']:.2f}s"
+                    + (f", {stats['errors']} failed" if stats['errors'] else "") + ")"
+                    for tier, stats in row['tiers'].items()
+                )
+                saved = f"{row['mean_seconds_saved']:+.2f}s" if row['mean_seconds_saved'] is not None else "n/a"
+                st.caption(f"**{task}**: {tiers} · saved ${row['cost_saved_usd']:.4f} · latency saved {saved}")
+    metrics_file = os.getenv("CAPTIONER_METRICS_FILE")
+    if metrics_file:
+        write_metrics_file(metrics.registry, metrics_file)
     
     # Footer
     st.markdown("---")
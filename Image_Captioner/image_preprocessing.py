@@ -0,0 +1,163 @@
+import hashlib
+import io
+import os
+from dataclasses import dataclass
+from typing import IO, Any, Dict, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# Decoders that can emit a downscaled bitmap directly (JPEG DCT scaling via Image.draft).
+DRAFT_FORMATS = {'JPEG', 'MPO'}
+
+
+class ImageTooLargeError(ValueError):
+    """The upload exceeds the configured pixel or decode-memory ceiling."""
+
+
+@dataclass
+class PreprocessConfig:
+    enabled: bool = True
+    max_long_edge: int = 1536
+    format: str = 'JPEG'
+    quality: int = 85
+    multiframe: str = 'first'
+    max_keyframes: int = 4
+    max_pixels: int = 100_000_000
+    max_decode_bytes: int = 512 * 1024 * 1024
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    size: Tuple[int, int]
+    original_size: Tuple[int, int]
+    original_bytes: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(0, self.original_bytes - len(self.data))
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    def as_blob(self) -> Dict[str, Any]:
+        return {'mime_type': self.mime_type, 'data': self.data}
+
+
+def source_bytes(image: Image.Image) -> int:
+    filename = getattr(image, 'filename', None)
+    if filename and os.path.isfile(filename):
+        return os.path.getsize(filename)
+    return image.width * image.height * len(image.getbands())
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """Flatten high bit depth, palette, CMYK and alpha images to 8-bit RGB or L."""
+    if image.mode in ('I;16', 'I;16B', 'I;16L', 'I;16N', 'I', 'F'):
+        image = image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    if image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La'):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    return image
+
+
+def _bytes_per_pixel(image: Image.Image) -> int:
+    return {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'I;16': 2, 'RGB': 3, 'YCbCr': 3, 'I': 4, 'F': 4}.get(image.mode, 4)
+
+
+def open_image(fp: Union[str, IO[bytes]], config: PreprocessConfig) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Open an upload within the configured limits, decoding only the resolution that will be used.
+
+    Limits are checked from the header before any pixels are decoded: max_pixels against the stored
+    dimensions, max_decode_bytes against the bitmap actually decoded after DCT scaling. When preprocessing
+    is enabled, still images are reduced to max_long_edge while decoding, so the full-size bitmap never
+    exists for JPEGs. Returns the image and its original (width, height).
+    """
+    try:
+        image = Image.open(fp)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"Image rejected as a possible decompression bomb: {e}") from e
+
+    original_size = image.size
+    width, height = original_size
+    if width * height > config.max_pixels:
+        image.close()
+        raise ImageTooLargeError(
+            f"Image is {width} × {height} ({width * height / 1e6:.0f} MP); "
+            f"the limit is {config.max_pixels / 1e6:.0f} MP."
+        )
+
+    reduce = config.enabled and max(original_size) > config.max_long_edge and getattr(image, 'n_frames', 1) == 1
+    if reduce and image.format in DRAFT_FORMATS:
+        scale = config.max_long_edge / max(original_size)
+        image.draft('RGB' if image.mode == 'RGB' else None, (max(1, int(width * scale)), max(1, int(height * scale))))
+
+    decode_bytes = image.width * image.height * _bytes_per_pixel(image)
+    if decode_bytes > config.max_decode_bytes:
+        image.close()
+        raise ImageTooLargeError(
+            f"Decoding this {width} × {height} image needs about {decode_bytes / 2**20:.0f} MiB; "
+            f"the limit is {config.max_decode_bytes / 2**20:.0f} MiB."
+        )
+
+    if reduce:
+        # In place on the unloaded image: the decoder fills a bitmap already scaled by draft(),
+        # and thumbnail() finishes the reduction with a cheap reducing gap before LANCZOS.
+        image.thumbnail((config.max_long_edge, config.max_long_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return image, original_size
+
+
+def make_preview(image: Image.Image, max_edge: int = 1024, format: str = 'JPEG', quality: int = 80) -> bytes:
+    """A display-size rendition of the first frame for the browser, as progressive JPEG or WebP."""
+    if getattr(image, 'n_frames', 1) > 1:
+        image.seek(0)
+    preview = ImageOps.exif_transpose(image)
+    if preview is image:
+        preview = image.copy()
+    preview.thumbnail((max_edge, max_edge), reducing_gap=2.0)
+    preview = _to_rgb(preview)
+    buffer = io.BytesIO()
+    if format.upper() == 'WEBP':
+        preview.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        preview.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def preprocess_image(image: Image.Image, config: PreprocessConfig, original_bytes: Optional[int] = None) -> PreparedImage:
+    """Orient, flatten, downscale and re-encode an image without metadata for upload to the model."""
+    original_size = image.size
+    if original_bytes is None:
+        original_bytes = source_bytes(image)
+
+    image = ImageOps.exif_transpose(image)
+    image = _to_rgb(image)
+    if max(image.size) > config.max_long_edge:
+        image = image.copy()
+        image.thumbnail((config.max_long_edge, config.max_long_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    image_format = config.format.upper()
+    buffer = io.BytesIO()
+    if image_format == 'WEBP':
+        image.save(buffer, format='WEBP', quality=config.quality, method=4)
+    else:
+        image_format = 'JPEG'
+        image.save(buffer, format='JPEG', quality=config.quality, optimize=True)
+
+    return PreparedImage(
+        data=buffer.getvalue(),
+        mime_type=MIME_TYPES[image_format],
+        size=image.size,
+        original_size=original_size,
+        original_bytes=original_bytes,
+    )
@@ -0,0 +1,93 @@
+import heapq
+import math
+from typing import Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+SIGNATURE_SIZE = (32, 32)
+HISTOGRAM_BINS = 32
+
+
+def frame_count(image: Image.Image) -> int:
+    return getattr(image, 'n_frames', 1)
+
+
+def is_animated(image: Image.Image) -> bool:
+    return frame_count(image) > 1
+
+
+def iter_frames(image: Image.Image, step: int = 1) -> Iterator[Tuple[int, Image.Image]]:
+    """Decode frames one at a time, yielding (index, RGB copy); restores the first frame afterwards."""
+    try:
+        for index in range(0, frame_count(image), step):
+            image.seek(index)
+            yield index, image.convert('RGB')
+    finally:
+        image.seek(0)
+
+
+def _signature(frame: Image.Image) -> List[float]:
+    histogram = frame.convert('L').resize(SIGNATURE_SIZE, Image.Resampling.BOX).histogram()
+    width = 256 // HISTOGRAM_BINS
+    binned = [sum(histogram[i:i + width]) for i in range(0, 256, width)]
+    total = float(sum(binned)) or 1.0
+    return [count / total for count in binned]
+
+
+def _difference(a: List[float], b: List[float]) -> float:
+    """Histogram difference in [0, 1]."""
+    return sum(abs(x - y) for x, y in zip(a, b)) / 2
+
+
+def select_keyframes(
+    image: Image.Image,
+    max_frames: int = 4,
+    threshold: float = 0.2,
+    max_decoded_frames: int = 300,
+    max_edge: int = 1024,
+) -> List[Image.Image]:
+    """Pick the first frame plus the strongest histogram scene changes, in playback order.
+
+    Frames are compared against the previous scene start; only the max_frames - 1 largest changes are kept,
+    so memory stays bounded by max_frames downscaled frames however long the animation is.
+    """
+    step = max(1, math.ceil(frame_count(image) / max_decoded_frames))
+    first = None
+    scene_signature = None
+    strongest = []
+    for index, frame in iter_frames(image, step):
+        frame.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR)
+        signature = _signature(frame)
+        if first is None:
+            first = frame
+            scene_signature = signature
+            continue
+        change = _difference(signature, scene_signature)
+        if change < threshold:
+            continue
+        scene_signature = signature
+        if max_frames <= 1:
+            continue
+        candidate = (change, index, frame)
+        if len(strongest) < max_frames - 1:
+            heapq.heappush(strongest, candidate)
+        elif change > strongest[0][0]:
+            heapq.heapreplace(strongest, candidate)
+
+    return [first] + [frame for _, _, frame in sorted(strongest, key=lambda item: item[1])]
+
+
+def contact_sheet(frames: List[Image.Image], columns: Optional[int] = None, max_cell: int = 512, gap: int = 4) -> Image.Image:
+    """Tile frames left-to-right, top-to-bottom into one image, with cells no larger than the frames need."""
+    columns = columns or math.ceil(math.sqrt(len(frames)))
+    cell = min(max_cell, max(max(frame.size) for frame in frames))
+    rows = math.ceil(len(frames) / columns)
+    sheet = Image.new('RGB', (columns * cell + (columns - 1) * gap, rows * cell + (rows - 1) * gap), (255, 255, 255))
+    for position, frame in enumerate(frames):
+        tile = frame.copy()
+        tile.thumbnail((cell, cell), Image.Resampling.LANCZOS)
+        row, column = divmod(position, columns)
+        x = column * (cell + gap) + (cell - tile.width) // 2
+        y = row * (cell + gap) + (cell - tile.height) // 2
+        sheet.paste(tile, (x, y))
+    return sheet
@@ -0,0 +1,284 @@
+import math
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def total(self, **labels) -> float:
+        with self._lock:
+            return sum(
+                value for key, value in self._values.items()
+                if all(key[self.labelnames.index(name)] == str(wanted) for name, wanted in labels.items())
+            )
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} counter", f"# HELP {self.name} {self.documentation}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS, unit: str = ''):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(set(buckets) | {math.inf}))
+        self.unit = unit
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self._values[key] = (counts, total + value)
+
+    def quantile(self, fraction: float, **labels) -> float:
+        """Upper bucket bound below which at least fraction of the matching observations fall."""
+        with self._lock:
+            merged = [0] * len(self.buckets)
+            for key, (counts, _) in self._values.items():
+                if all(key[self.labelnames.index(name)] == str(wanted) for name, wanted in labels.items()):
+                    merged = [a + b for a, b in zip(merged, counts)]
+        if not merged[-1]:
+            return 0.0
+        for bound, count in zip(self.buckets, merged):
+            if count >= fraction * merged[-1]:
+                return bound
+        return math.inf
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.documentation}"]
+        if self.unit:
+            lines.insert(1, f"# UNIT {self.name} {self.unit}")
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """OpenMetrics text exposition of every registered metric."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+def opentelemetry_tracer(name: str = 'image_captioner') -> Optional[Any]:
+    """A tracer from the globally configured OpenTelemetry provider, or None when opentelemetry is not installed."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_tracer(name)
+
+
+def usage_tokens(response: Any) -> Tuple[int, int]:
+    """(prompt, output) token counts from a response's usage_metadata, zeros when absent."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, 'prompt_token_count', 0) or 0, getattr(usage, 'candidates_token_count', 0) or 0
+
+
+def _image_bytes(parts: Iterable[Any]) -> int:
+    # Preprocessed uploads are blobs of known size; raw PIL images are encoded later by the SDK and not counted.
+    return sum(len(part['data']) for part in parts if isinstance(part, dict) and 'data' in part)
+
+
+class CaptionerMetrics:
+    """Latency, token, upload size, error and cache metrics for every model call, with optional tracing spans."""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, tracer: Optional[Any] = None):
+        self.registry = registry or MetricsRegistry()
+        self.tracer = tracer
+        labels = ('task', 'model', 'backend')
+        self.request_seconds = self.registry.register(Histogram(
+            'captioner_model_request_duration_seconds', "Latency of each model call attempt.",
+            labels + ('outcome',), unit='seconds',
+        ))
+        self.requests = self.registry.register(Counter(
+            'captioner_model_requests', "Model call attempts by outcome and error class.", labels + ('outcome', 'error'),
+        ))
+        self.prompt_tokens = self.registry.register(Counter(
+            'captioner_prompt_tokens', "Prompt tokens reported in usage_metadata.", labels,
+        ))
+        self.output_tokens = self.registry.register(Counter(
+            'captioner_output_tokens', "Output tokens reported in usage_metadata.", labels,
+        ))
+        self.image_bytes = self.registry.register(Counter(
+            'captioner_image_bytes_sent', "Encoded image bytes sent to the model.", labels,
+        ))
+        self.cache_lookups = self.registry.register(Counter(
+            'captioner_cache_lookups', "Result lookups before a model call: exact hit, near-duplicate hit or miss.",
+            ('task', 'model', 'result'),
+        ))
+
+    def record_lookup(self, task: Optional[str], model: str, result: str):
+        self.cache_lookups.inc(task=task or 'all', model=model, result=result)
+
+    def instrument(self, task: Optional[str], backend: Any, parts: List[Any], call: Callable[[], Any], stream: bool = False) -> Any:
+        """Run one model call, recording it when it returns, or for streams when the last chunk arrives."""
+        labels = {'task': task or 'all', 'model': backend.model_name, 'backend': backend.name}
+        image_bytes = _image_bytes(parts)
+        span = None
+        if self.tracer is not None:
+            span = self.tracer.start_span('captioner.generate_content', attributes={
+                'captioner.task': labels['task'],
+                'gen_ai.system': labels['backend'],
+                'gen_ai.request.model': labels['model'],
+                'captioner.image_bytes': image_bytes,
+                'captioner.stream': stream,
+            })
+        started = time.perf_counter()
+        try:
+            response = call()
+        except Exception as e:
+            self._finish(labels, started, image_bytes, span, error=e)
+            raise
+        if stream:
+            return self._observe_stream(response, labels, started, image_bytes, span)
+        self._finish(labels, started, image_bytes, span, response=response)
+        return response
+
+    def _observe_stream(self, chunks: Iterable[Any], labels: Dict[str, str], started: float, image_bytes: int, span) -> Iterator[Any]:
+        last = None
+        try:
+            for chunk in chunks:
+                last = chunk
+                yield chunk
+        except Exception as e:
+            self._finish(labels, started, image_bytes, span, error=e)
+            raise
+        # usage_metadata on the final chunk covers the whole stream.
+        self._finish(labels, started, image_bytes, span, response=last)
+
+    def _finish(self, labels: Dict[str, str], started: float, image_bytes: int, span, response: Any = None, error: Optional[BaseException] = None):
+        seconds = time.perf_counter() - started
+        outcome = 'error' if error is not None else 'ok'
+        error_class = type(error).__name__ if error is not None else ''
+        prompt_tokens, output_tokens = usage_tokens(response)
+
+        self.request_seconds.observe(seconds, outcome=outcome, **labels)
+        self.requests.inc(outcome=outcome, error=error_class, **labels)
+        self.image_bytes.inc(image_bytes, **labels)
+        if prompt_tokens:
+            self.prompt_tokens.inc(prompt_tokens, **labels)
+        if output_tokens:
+            self.output_tokens.inc(output_tokens, **labels)
+
+        if span is not None:
+            span.set_attribute('gen_ai.usage.input_tokens', prompt_tokens)
+            span.set_attribute('gen_ai.usage.output_tokens', output_tokens)
+            if error is not None:
+                span.set_attribute('error.type', error_class)
+                span.record_exception(error)
+                try:
+                    from opentelemetry.trace import Status, StatusCode
+                except ImportError:
+                    pass
+                else:
+                    span.set_status(Status(StatusCode.ERROR, str(error)))
+            span.end()
+
+    def summary(self) -> Dict[str, float]:
+        requests = self.requests.total()
+        lookups = self.cache_lookups.total()
+        return {
+            'requests': requests,
+            'errors': self.requests.total(outcome='error'),
+            'p50_seconds': self.request_seconds.quantile(0.5, outcome='ok'),
+            'p95_seconds': self.request_seconds.quantile(0.95, outcome='ok'),
+            'prompt_tokens': self.prompt_tokens.total(),
+            'output_tokens': self.output_tokens.total(),
+            'image_bytes': self.image_bytes.total(),
+            'cache_hit_rate': (lookups - self.cache_lookups.total(result='miss')) / lookups if lookups else 0.0,
+        }
+
+
+def write_metrics_file(registry: MetricsRegistry, path: str):
+    """Atomically replace path with the current exposition, for node-exporter style textfile collection."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(temp_path, path)
+
+
+def serve_metrics(registry: MetricsRegistry, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Serve the exposition at /metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,83 @@
+import os
+import time
+
+import streamlit as st
+
+from image_captioner import PAGE_STYLE
+from semantic_index import EmbeddingIndex, create_embedder
+
+
+@st.cache_resource
+def get_index(directory: str) -> EmbeddingIndex:
+    # The index re-reads its header on each search, so rows added by the CLI show up without a restart.
+    return EmbeddingIndex(directory)
+
+
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_embedder(name: str, api_key: str, dim: int):
+    return create_embedder(name, api_key, dim)
+
+
+def main():
+    st.set_page_config(page_title="VisionCraft - Caption Search", page_icon="🔎", layout="wide")
+    st.markdown(PAGE_STYLE, unsafe_allow_html=True)
+    st.markdown('<h1 class="main-header">🔎 Search Captioned Images</h1>', unsafe_allow_html=True)
+
+    st.sidebar.header("🔧 Index")
+    directory = st.sidebar.text_input("Index directory", value=os.getenv("CAPTIONER_INDEX_DIR", ".captioner_index"))
+    try:
+        index = get_index(directory)
+    except FileNotFoundError:
+        st.info(f"No index at `{directory}` yet. Build one from bulk captioning output:\n\n"
+                "```bash\npython semantic_index.py add captions.jsonl --index " + directory + "\n```")
+        return
+
+    embedder_name = index.header['embedder']
+    api_key = ''
+    if embedder_name == 'gemini':
+        api_key = st.sidebar.text_input("Enter your Google Gemini API Key:", type="password", value=os.getenv("GOOGLE_API_KEY", ""))
+        if not api_key:
+            st.sidebar.warning(" Please enter your Gemini API key to embed queries.")
+            return
+
+    top_k = st.sidebar.slider("Results", min_value=1, max_value=50, value=10)
+    nprobe = None
+    if index.header.get('ivf_rows'):
+        exact = st.sidebar.checkbox("Exact search", value=False, help="Score every row instead of the nearest IVF lists")
+        lists = index.header['ivf_lists']
+        if not exact:
+            nprobe = st.sidebar.slider("IVF lists to scan", min_value=1, max_value=min(128, lists), value=min(8, lists)) if lists > 1 else 1
+    st.sidebar.caption(
+        f"🗂️ {len(index):,} captions · {embedder_name} embeddings · {index.dim} × {index.header['dtype']}"
+        + (f" · IVF {index.header['ivf_lists']} lists over {index.header['ivf_rows']:,} rows" if index.header.get('ivf_rows') else "")
+    )
+
+    query = st.text_input("Describe the image you are looking for", placeholder="a dog running on a beach at sunset")
+    if not query:
+        return
+
+    try:
+        embedder = get_embedder(embedder_name, api_key, index.dim)
+        started = time.perf_counter()
+        vector = embedder.embed([query], kind='query')[0]
+        embedded = time.perf_counter()
+        results = index.search(vector, k=top_k, nprobe=nprobe)
+        searched = time.perf_counter()
+    except Exception as e:
+        st.error(f"❌ Search failed: {str(e)}")
+        return
+
+    st.caption(f"⏱️ embed {(embedded - started) * 1000:.0f} ms · search {(searched - embedded) * 1000:.1f} ms")
+    for result in results:
+        st.markdown('<div class="result-container">', unsafe_allow_html=True)
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            if os.path.isfile(result['id']):
+                st.image(result['id'], use_container_width=True)
+        with col2:
+            st.markdown(f"**{result['id']}** · similarity {result['score']:.3f}")
+            st.write(result['text'])
+        st.markdown('</div>', unsafe_allow_html=True)
+
+
+main()
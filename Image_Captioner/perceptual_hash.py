@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from PIL import Image
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash: one bit per horizontally adjacent pair of pixels in a tiny grayscale thumbnail."""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def colour_signature(image: Image.Image, grid: int = 2) -> Tuple[int, ...]:
+    """Mean RGB of each cell of a grid x grid thumbnail: the coarse colour layout that dhash cannot see."""
+    small = image.convert('RGB').resize((grid, grid), Image.Resampling.BOX, reducing_gap=2.0)
+    return tuple(channel for pixel in small.getdata() for channel in pixel)
+
+
+def colour_distance(a: Tuple[int, ...], b: Tuple[int, ...]) -> int:
+    """Largest per-channel difference between two colour signatures, 0-255."""
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes under Hamming distance."""
+
+    def __init__(self):
+        self._root = None
+
+    def add(self, value: int):
+        if self._root is None:
+            self._root = (value, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """All (distance, hash) pairs within max_distance, nearest first."""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, node_value))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches)
+
+
+class PerceptualIndex:
+    """Near-duplicate lookup of prior model outputs, keyed by perceptual hash and request variant.
+
+    dHash is computed on grayscale, so a red and a blue shirt of the same shape hash alike. A candidate
+    within max_distance bits is only accepted when its colour signature is also within max_colour_distance.
+    """
+
+    def __init__(self, max_entries: int = 20000, max_colour_distance: int = 24):
+        self.max_entries = max_entries
+        self.max_colour_distance = max_colour_distance
+        self.lookups = 0
+        self.hits = 0
+        self._records = OrderedDict()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def lookup(self, image_hash: int, variant: str, max_distance: int, colour: Optional[Tuple[int, ...]] = None) -> Optional[Any]:
+        with self._lock:
+            self.lookups += 1
+            for _, candidate in self._tree.search(image_hash, max_distance):
+                # Images that share a hash but differ in colour are kept as separate entries.
+                for entry_colour, values in self._records.get(candidate, ()):
+                    if variant not in values:
+                        continue
+                    if colour is not None and entry_colour is not None \
+                            and colour_distance(colour, entry_colour) > self.max_colour_distance:
+                        continue
+                    self.hits += 1
+                    return values[variant]
+            return None
+
+    def add(self, image_hash: int, variant: str, value: Any, colour: Optional[Tuple[int, ...]] = None):
+        with self._lock:
+            entries = self._records.get(image_hash)
+            if entries is None:
+                entries = self._records[image_hash] = []
+                self._tree.add(image_hash)
+            for entry_colour, values in entries:
+                if entry_colour == colour:
+                    break
+            else:
+                values = {}
+                entries.append((colour, values))
+            values[variant] = value
+            self._records.move_to_end(image_hash)
+            if len(self._records) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # BK-trees do not support deletion, so drop the oldest quarter and rebuild.
+        for _ in range(max(1, len(self._records) // 4)):
+            self._records.popitem(last=False)
+        self._tree = BKTree()
+        for image_hash in self._records:
+            self._tree.add(image_hash)
+
+    @property
+    def dedupe_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._records)
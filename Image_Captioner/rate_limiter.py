@@ -0,0 +1,193 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+QUOTA_ERRORS = (google_exceptions.TooManyRequests,)
+RETRYABLE_ERRORS = QUOTA_ERRORS + (
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+# Gemini bills a fixed number of input tokens per image regardless of resolution.
+TOKENS_PER_IMAGE = 258
+
+
+def estimate_tokens(prompt: str, image_count: int = 1) -> int:
+    return len(prompt) // 4 + TOKENS_PER_IMAGE * image_count
+
+
+def is_quota_error(error: BaseException) -> bool:
+    return isinstance(error, QUOTA_ERRORS)
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to capacity; may go into debt when usage is reconciled."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> float:
+        """Block until amount is available and take it, returning the seconds spent waiting."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take amount if it is available right now; never waits."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens < amount:
+                return False
+            self._tokens -= amount
+            return True
+
+    def set_rate(self, rate_per_minute: float):
+        """Change the refill rate in place; the capacity follows it, and current tokens are kept up to it."""
+        with self._lock:
+            self._refill()
+            self.rate = rate_per_minute / 60.0
+            self.capacity = rate_per_minute
+            self._tokens = min(self.capacity, self._tokens)
+
+    def adjust(self, amount: float):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    """Shared RPM/TPM limiter with retries, exponential backoff and AIMD concurrency control."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 1_000_000,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.retries = 0
+        self.quota_errors = 0
+        self.throttled_seconds = 0.0
+        self._condition = threading.Condition()
+
+    def try_grant(self, estimated_tokens: int = 0) -> bool:
+        """Take one request and estimated_tokens from the quota only if both are available now.
+
+        For optional extra calls, such as hedges, that should be skipped rather than wait when quota is short.
+        They take no concurrency slot and are not retried.
+        """
+        if not self.requests.try_acquire(1):
+            return False
+        if not self.tokens.try_acquire(estimated_tokens):
+            self.requests.adjust(-1)
+            return False
+        return True
+
+    def set_quota(self, requests_per_minute: float, tokens_per_minute: float):
+        """Apply new RPM/TPM limits without resetting usage, backoff or concurrency state."""
+        if requests_per_minute != self.requests.rate * 60:
+            self.requests.set_rate(requests_per_minute)
+        if tokens_per_minute != self.tokens.rate * 60:
+            self.tokens.set_rate(tokens_per_minute)
+
+    @contextmanager
+    def _slot(self):
+        with self._condition:
+            while self.in_flight >= max(self.min_concurrency, int(self.concurrency_limit)):
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def _on_success(self):
+        with self._condition:
+            # Additive increase: roughly one extra slot per window of successful calls.
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+            self._condition.notify()
+
+    def _on_quota_error(self):
+        with self._condition:
+            self.quota_errors += 1
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int = 0) -> Any:
+        """Run fn under the limits, retrying retryable errors; reconciles the token bucket with usage_metadata."""
+        attempt = 0
+        while True:
+            with self._slot():
+                self.throttled_seconds += self.requests.acquire(1)
+                self.throttled_seconds += self.tokens.acquire(estimated_tokens)
+                try:
+                    result = fn()
+                except Exception as e:
+                    if is_quota_error(e):
+                        self._on_quota_error()
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        raise
+                    error = e
+                else:
+                    usage = getattr(result, 'usage_metadata', None)
+                    total_tokens = getattr(usage, 'total_token_count', None)
+                    if total_tokens:
+                        self.tokens.adjust(total_tokens - estimated_tokens)
+                    self._on_success()
+                    return result
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            self.retries += 1
+            logger.warning("Retryable %s (attempt %d), retrying in %.1fs", type(error).__name__, attempt, delay)
+            time.sleep(delay)
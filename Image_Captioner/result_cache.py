@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from PIL import Image
+
+
+def image_digest(image: Image.Image) -> str:
+    """SHA-256 of the decoded pixel data, mode and size of an image."""
+    hasher = hashlib.sha256()
+    hasher.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+def make_cache_key(digest: str, prompt: str, model_name: str, generation_config: Any = None) -> str:
+    """Content-addressed key for one model call."""
+    hasher = hashlib.sha256()
+    for part in (digest, prompt, model_name, repr(generation_config)):
+        hasher.update(part.encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """In-process LRU of model outputs, optionally backed by a size- and TTL-bounded SQLite file."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: Optional[float] = 7 * 24 * 3600,
+        disk_path: Optional[str] = None,
+        disk_max_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self._db.commit()
+            self._evict_disk()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    if not self._expired(created, now):
+                        self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, value, created)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode()), now, now),
+                )
+                self._db.commit()
+                self._evict_disk()
+
+    def _remember(self, key: str, value: str, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl_seconds,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        while total > self.disk_max_bytes:
+            rows = self._db.execute("SELECT key, size FROM results ORDER BY accessed LIMIT 64").fetchall()
+            if not rows:
+                break
+            self._db.executemany("DELETE FROM results WHERE key = ?", [(key,) for key, _ in rows])
+            total -= sum(size for _, size in rows)
+        self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
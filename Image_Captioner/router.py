@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from backends import CaptionBackend
+from metrics import usage_tokens
+
+
+@dataclass
+class ModelTier:
+    model_name: str
+    # USD per million tokens, used only for the savings report.
+    input_cost_per_million: float
+    output_cost_per_million: float
+
+    def cost(self, prompt_tokens: int, output_tokens: int) -> float:
+        return (prompt_tokens * self.input_cost_per_million + output_tokens * self.output_cost_per_million) / 1e6
+
+
+@dataclass
+class TaskRoute:
+    preferred: str
+    latency_budget_seconds: float
+    fallbacks: List[str] = field(default_factory=list)
+
+
+DEFAULT_TIERS = {
+    'flash-8b': ModelTier('gemini-1.5-flash-8b', 0.0375, 0.15),
+    'flash': ModelTier('gemini-1.5-flash', 0.075, 0.30),
+    'pro': ModelTier('gemini-1.5-pro', 1.25, 5.00),
+}
+
+# Short outputs go to the smallest tier; long-form captions keep the standard model but may fall back.
+# None is the fused all-content request.
+DEFAULT_ROUTES = {
+    'alt_text': TaskRoute('flash-8b', 3.0, ['flash']),
+    'keywords': TaskRoute('flash-8b', 3.0, ['flash']),
+    'social_caption': TaskRoute('flash', 6.0, ['flash-8b']),
+    'detailed_caption': TaskRoute('flash', 10.0, ['flash-8b']),
+    None: TaskRoute('flash', 12.0, ['flash-8b']),
+}
+
+BASELINE_TIER = 'flash'
+
+
+def _p95(samples: Iterable[float]) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0
+
+
+class ModelRouter:
+    """Chooses a model tier per task, moving to a fallback while the preferred tier's rolling p95 is over budget.
+
+    While degraded, every probe_every-th request for a task still goes to the preferred tier so its
+    latency window keeps updating and the route recovers once it is back within budget.
+    """
+
+    def __init__(
+        self,
+        tiers: Optional[Dict[str, ModelTier]] = None,
+        routes: Optional[Dict[Optional[str], TaskRoute]] = None,
+        baseline_tier: str = BASELINE_TIER,
+        window: int = 20,
+        min_samples: int = 10,
+        probe_every: int = 5,
+    ):
+        self.tiers = dict(DEFAULT_TIERS if tiers is None else tiers)
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.baseline_tier = baseline_tier
+        self.window = window
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self._latencies = {}
+        self._stats = {}
+        self._degraded_requests = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], **kwargs) -> 'ModelRouter':
+        """Build from {"tiers": {name: {...ModelTier}}, "routes": {task|"all": {...TaskRoute}}, "baseline_tier": name}."""
+        tiers = {name: ModelTier(**tier) for name, tier in config.get('tiers', {}).items()} or None
+        routes = None
+        if 'routes' in config:
+            routes = {(None if task == 'all' else task): TaskRoute(**route) for task, route in config['routes'].items()}
+        return cls(tiers=tiers, routes=routes, baseline_tier=config.get('baseline_tier', BASELINE_TIER), **kwargs)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'ModelRouter':
+        with open(path, encoding='utf-8') as f:
+            return cls.from_config(json.load(f), **kwargs)
+
+    def _route(self, task: Optional[str]) -> TaskRoute:
+        return self.routes.get(task) or self.routes.get(None) or TaskRoute(self.baseline_tier, float('inf'))
+
+    def p95(self, task: Optional[str], tier: str) -> Optional[float]:
+        with self._lock:
+            samples = self._latencies.get((task, tier))
+            if not samples or len(samples) < self.min_samples:
+                return None
+            return _p95(samples)
+
+    def _over_budget(self, task: Optional[str], tier: str, budget: float) -> bool:
+        p95 = self.p95(task, tier)
+        return p95 is not None and p95 > budget
+
+    def choose(self, task: Optional[str]) -> str:
+        route = self._route(task)
+        if not self._over_budget(task, route.preferred, route.latency_budget_seconds):
+            return route.preferred
+
+        with self._lock:
+            count = self._degraded_requests[task] = self._degraded_requests.get(task, 0) + 1
+        if count % self.probe_every == 0:
+            return route.preferred
+        for tier in route.fallbacks:
+            if not self._over_budget(task, tier, route.latency_budget_seconds):
+                return tier
+        return route.preferred
+
+    def _tier_stats(self, task: Optional[str], tier: str) -> Dict[str, Any]:
+        return self._stats.setdefault((task, tier), {'requests': 0, 'errors': 0, 'seconds': 0.0, 'prompt_tokens': 0, 'output_tokens': 0})
+
+    def record_failure(self, task: Optional[str], tier: str, seconds: float):
+        """Count a failed attempt. It enters the latency window at twice the route's budget (or its real
+        duration, if longer), so a tier that keeps erroring or timing out falls back like a slow one."""
+        budget = self._route(task).latency_budget_seconds
+        penalty = max(seconds, 2 * budget) if budget != float('inf') else seconds
+        with self._lock:
+            self._latencies.setdefault((task, tier), deque(maxlen=self.window)).append(penalty)
+            self._tier_stats(task, tier)['errors'] += 1
+
+    def record(self, task: Optional[str], tier: str, seconds: float, prompt_tokens: int = 0, output_tokens: int = 0):
+        with self._lock:
+            self._latencies.setdefault((task, tier), deque(maxlen=self.window)).append(seconds)
+            stats = self._tier_stats(task, tier)
+            stats['requests'] += 1
+            stats['seconds'] += seconds
+            stats['prompt_tokens'] += prompt_tokens
+            stats['output_tokens'] += output_tokens
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Per task: requests and latency by tier, and cost and mean latency saved against the baseline tier.
+
+        Cost savings price the same tokens at the baseline tier. Latency savings compare against the baseline
+        tier's observed mean for the task, so they are None until the baseline has served that task.
+        """
+        with self._lock:
+            stats = {key: dict(value) for key, value in self._stats.items()}
+            windows = {key: list(value) for key, value in self._latencies.items()}
+        baseline = self.tiers.get(self.baseline_tier)
+        report = {}
+        for task in sorted({task for task, _ in stats}, key=lambda task: task or ''):
+            tiers = {tier: value for (key, tier), value in stats.items() if key == task}
+            requests = sum(value['requests'] for value in tiers.values())
+            seconds = sum(value['seconds'] for value in tiers.values())
+            cost = sum(self.tiers[tier].cost(value['prompt_tokens'], value['output_tokens']) for tier, value in tiers.items() if tier in self.tiers)
+            baseline_cost = sum(baseline.cost(value['prompt_tokens'], value['output_tokens']) for value in tiers.values()) if baseline else cost
+            baseline_stats = tiers.get(self.baseline_tier)
+            latency_saved = None
+            if baseline_stats and baseline_stats['requests']:
+                latency_saved = baseline_stats['seconds'] / baseline_stats['requests'] - seconds / requests
+            report[task or 'all'] = {
+                'tiers': {
+                    tier: {
+                        'requests': value['requests'],
+                        'errors': value['errors'],
+                        'mean_seconds': round(value['seconds'] / value['requests'], 3) if value['requests'] else None,
+                        'p95_seconds': round(_p95(windows.get((task, tier), [])), 3),
+                    }
+                    for tier, value in tiers.items()
+                },
+                'requests': requests,
+                'mean_seconds': round(seconds / requests, 3) if requests else 0.0,
+                'cost_usd': round(cost, 6),
+                'baseline_cost_usd': round(baseline_cost, 6),
+                'cost_saved_usd': round(baseline_cost - cost, 6),
+                'mean_seconds_saved': round(latency_saved, 3) if latency_saved is not None else None,
+            }
+        return report
+
+
+class RoutedBackend(CaptionBackend):
+    """Sends each task to the backend for the tier ModelRouter picks, and feeds latency and tokens back to it."""
+
+    name = 'routed'
+
+    def __init__(self, backends: Dict[str, CaptionBackend], router: ModelRouter):
+        super().__init__('routed:' + ','.join(sorted(backend.model_name for backend in backends.values())))
+        self.backends = backends
+        self.router = router
+        self.supports_structured_output = all(backend.supports_structured_output for backend in backends.values())
+        self.supports_streaming = all(backend.supports_streaming for backend in backends.values())
+        self.rate_limited = any(backend.rate_limited for backend in backends.values())
+
+    def generate(self, task, prompt, parts, generation_config=None, stream=False):
+        tier = self.router.choose(task)
+        started = time.perf_counter()
+        try:
+            response = self.backends[tier].generate(task, prompt, parts, generation_config=generation_config, stream=stream)
+        except Exception:
+            self.router.record_failure(task, tier, time.perf_counter() - started)
+            raise
+        if stream:
+            return self._record_stream(response, task, tier, started)
+        self._finish(task, tier, started, response)
+        return response
+
+    def _record_stream(self, chunks: Iterable[Any], task: Optional[str], tier: str, started: float) -> Iterator[Any]:
+        last = None
+        try:
+            for chunk in chunks:
+                last = chunk
+                yield chunk
+        except Exception:
+            self.router.record_failure(task, tier, time.perf_counter() - started)
+            raise
+        self._finish(task, tier, started, last)
+
+    def _finish(self, task: Optional[str], tier: str, started: float, response: Any):
+        prompt_tokens, output_tokens = usage_tokens(response)
+        self.router.record(task, tier, time.perf_counter() - started, prompt_tokens, output_tokens)
+        self._record(1, started)
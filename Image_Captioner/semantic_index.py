@@ -0,0 +1,466 @@
+"""Semantic search over generated captions, backed by an append-only memory-mapped vector file.
+
+    python semantic_index.py add captions.jsonl --index .captioner_index
+    python semantic_index.py build-ivf --index .captioner_index
+    python semantic_index.py search "dog running on a beach" --index .captioner_index -k 5
+
+An index directory holds:
+
+    index.json     dim, dtype, embedder, and the committed row count and metadata size
+    vectors.bin    row-major unit vectors, float32 or float16, appended in place
+    meta.jsonl     one {"id", "text"} object per row
+    meta.offsets   uint64 byte offset of each row in meta.jsonl
+    ivf_*.npy      optional coarse index: centroids, per-list offsets and row ids
+
+Rows are written before index.json is replaced, so a crash mid-append leaves the previous rows intact;
+the partial tail is truncated on the next append.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backends import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words feature hashing; needs no model or network, for tests and offline use."""
+
+    name = 'hashing'
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _token_slot(self, token: str) -> Tuple[int, float]:
+        value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts: List[str], kind: str = 'document') -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                if token not in STOPWORDS:
+                    slot, sign = self._token_slot(token)
+                    vectors[row, slot] += sign
+        return normalize(vectors)
+
+
+class GeminiEmbedder:
+    """Gemini text embeddings, with separate task types for indexed captions and queries."""
+
+    name = 'gemini'
+
+    def __init__(self, api_key: str, model_name: str = 'models/text-embedding-004', dim: int = 768, rate_limiter: Optional[Any] = None):
+        import google.ai.generativelanguage as glm
+
+        self.model_name = model_name
+        self.dim = dim
+        self.rate_limiter = rate_limiter
+        self.client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+
+    def embed(self, texts: List[str], kind: str = 'document') -> np.ndarray:
+        import google.generativeai as genai
+
+        def call():
+            return genai.embed_content(
+                model=self.model_name,
+                content=texts,
+                task_type='retrieval_query' if kind == 'query' else 'retrieval_document',
+                output_dimensionality=self.dim,
+                client=self.client,
+            )
+
+        if self.rate_limiter is not None:
+            result = self.rate_limiter.call(call, estimated_tokens=sum(len(text) // 4 + 1 for text in texts))
+        else:
+            result = call()
+        return normalize(result['embedding'])
+
+
+class TransformersEmbedder:
+    """Mean-pooled sentence embeddings from a local Hugging Face encoder."""
+
+    name = 'transformers'
+
+    def __init__(self, model: Any, tokenizer: Any, model_name: str = 'local'):
+        model.eval()
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_name = model_name
+        self.dim = model.config.hidden_size
+
+    @classmethod
+    def from_pretrained(cls, model_name: str = 'sentence-transformers/all-MiniLM-L6-v2') -> 'TransformersEmbedder':
+        from transformers import AutoModel, AutoTokenizer
+
+        return cls(AutoModel.from_pretrained(model_name), AutoTokenizer.from_pretrained(model_name), model_name=model_name)
+
+    def embed(self, texts: List[str], kind: str = 'document') -> np.ndarray:
+        import torch
+
+        batch = self.tokenizer(texts, padding=True, truncation=True, max_length=256, return_tensors='pt')
+        with torch.inference_mode():
+            hidden = self.model(**batch).last_hidden_state
+        mask = batch['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return normalize(pooled.numpy())
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[keep], rows[keep]
+    order = np.argsort(-scores, kind='stable')
+    return scores[order], rows[order]
+
+
+def _write_json(path: str, value: Dict[str, Any]):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(temp_path, path)
+
+
+class EmbeddingIndex:
+    """Unit vectors in an append-only memory-mapped file with exact or IVF top-k search by cosine similarity.
+
+    Searches stream the vector file in chunks, so memory stays bounded by chunk_rows regardless of index size.
+    """
+
+    def __init__(self, directory: str, dim: Optional[int] = None, dtype: str = 'float32', embedder: Optional[str] = None, chunk_rows: int = 16384):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self._header_path = os.path.join(directory, 'index.json')
+        self._vectors_path = os.path.join(directory, 'vectors.bin')
+        self._meta_path = os.path.join(directory, 'meta.jsonl')
+        self._offsets_path = os.path.join(directory, 'meta.offsets')
+        self._header_version = None
+        self._vectors = None
+        self._offsets = None
+        self._ivf = None
+        if os.path.exists(self._header_path):
+            self._refresh()
+            if dim is not None and dim != self.dim:
+                raise ValueError(f"Index {directory} has dim {self.dim}, not {dim}")
+            if embedder is not None and embedder != self.header['embedder']:
+                raise ValueError(f"Index {directory} was built with the {self.header['embedder']} embedder, not {embedder}")
+        else:
+            if dim is None:
+                raise FileNotFoundError(f"No index at {directory}; pass dim to create one")
+            if dtype not in ('float32', 'float16'):
+                raise ValueError("dtype must be float32 or float16")
+            os.makedirs(directory, exist_ok=True)
+            for path in (self._vectors_path, self._meta_path, self._offsets_path):
+                open(path, 'wb').close()
+            _write_json(self._header_path, {'dim': dim, 'dtype': dtype, 'embedder': embedder, 'count': 0, 'meta_bytes': 0, 'ivf_rows': 0})
+            self._refresh()
+
+    @property
+    def dim(self) -> int:
+        return self.header['dim']
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.header['dtype'])
+
+    def __len__(self) -> int:
+        self._refresh()
+        return self.header['count']
+
+    def _refresh(self):
+        """Reload the header, and the maps that depend on it, when another process has appended or rebuilt."""
+        stat = os.stat(self._header_path)
+        # index.json is replaced, never rewritten in place, so a new inode always means a new header.
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version == self._header_version:
+            return
+        with open(self._header_path, encoding='utf-8') as f:
+            self.header = json.load(f)
+        self._header_version = version
+        count = self.header['count']
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode='r', shape=(count, self.dim)) if count else None
+        self._offsets = np.memmap(self._offsets_path, dtype=np.uint64, mode='r', shape=(count,)) if count else None
+        self._ivf = None
+        if self.header.get('ivf_rows'):
+            self._ivf = tuple(
+                np.load(os.path.join(self.directory, f'ivf_{name}.npy'), mmap_mode='r')
+                for name in ('centroids', 'offsets', 'rows')
+            )
+
+    def add(self, ids: List[str], texts: List[str], vectors: np.ndarray):
+        """Append rows; vectors are normalized and stored in the index dtype."""
+        vectors = normalize(vectors)
+        if vectors.shape != (len(ids), self.dim) or len(texts) != len(ids):
+            raise ValueError(f"Expected {len(ids)} vectors of dim {self.dim}, got {vectors.shape}")
+        self._refresh()
+        count, meta_bytes = self.header['count'], self.header['meta_bytes']
+
+        lines = [(json.dumps({'id': id_, 'text': text}, ensure_ascii=False) + '\n').encode('utf-8') for id_, text in zip(ids, texts)]
+        offsets = np.cumsum([meta_bytes] + [len(line) for line in lines[:-1]], dtype=np.uint64)
+        for path, size, data in (
+            (self._vectors_path, count * self.dim * self.dtype.itemsize, vectors.astype(self.dtype).tobytes()),
+            (self._offsets_path, count * 8, offsets.tobytes()),
+            (self._meta_path, meta_bytes, b''.join(lines)),
+        ):
+            with open(path, 'r+b') as f:
+                # Drop any partial tail from an interrupted append before writing after the committed rows.
+                f.truncate(size)
+                f.seek(size)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        header = dict(self.header, count=count + len(ids), meta_bytes=meta_bytes + sum(len(line) for line in lines))
+        _write_json(self._header_path, header)
+        self._refresh()
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        with open(self._meta_path, 'rb') as f:
+            f.seek(int(self._offsets[row]))
+            return json.loads(f.readline())
+
+    def ids(self) -> Iterator[str]:
+        self._refresh()
+        with open(self._meta_path, 'rb') as f:
+            for _ in range(self.header['count']):
+                yield json.loads(f.readline())['id']
+
+    def _scan(self, query: np.ndarray, start: int, stop: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for chunk_start in range(start, stop, self.chunk_rows):
+            chunk_stop = min(stop, chunk_start + self.chunk_rows)
+            # NumPy has no fast float16 matmul; widening one chunk at a time keeps the copy bounded.
+            scores = np.asarray(self._vectors[chunk_start:chunk_stop], dtype=np.float32) @ query
+            rows = np.arange(chunk_start, chunk_stop, dtype=np.int64)
+            best_scores, best_rows = _top_k(
+                np.concatenate([best_scores, scores]), np.concatenate([best_rows, rows]), k
+            )
+        return best_scores, best_rows
+
+    def _probe(self, query: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, offsets, list_rows = self._ivf
+        nprobe = min(nprobe, len(centroids))
+        lists = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.sort(np.concatenate([list_rows[offsets[i]:offsets[i + 1]] for i in lists]))
+        if not len(rows):
+            return np.empty(0, dtype=np.float32), rows
+        return np.asarray(self._vectors[rows], dtype=np.float32) @ query, rows
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: Optional[int] = 8) -> List[Dict[str, Any]]:
+        """The k rows most similar to query, with their id, text and cosine score.
+
+        With an IVF index and nprobe set, only the nprobe nearest lists plus rows appended since the
+        IVF build are scored; nprobe=None always scans every row.
+        """
+        self._refresh()
+        count = self.header['count']
+        if not count or k <= 0:
+            return []
+        query = normalize(query).reshape(self.dim)
+        if self._ivf is not None and nprobe:
+            indexed = self.header['ivf_rows']
+            scores, rows = self._probe(query, nprobe)
+            tail_scores, tail_rows = self._scan(query, indexed, count, k)
+            scores, rows = _top_k(np.concatenate([scores, tail_scores]), np.concatenate([rows, tail_rows]), k)
+        else:
+            scores, rows = self._scan(query, 0, count, k)
+        return [{'row': int(row), 'score': float(score), **self.metadata(int(row))} for score, row in zip(scores, rows)]
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, sample_size: Optional[int] = None, seed: int = 0) -> int:
+        """Cluster the current rows into nlist inverted lists with spherical k-means; returns nlist."""
+        self._refresh()
+        count = self.header['count']
+        if not count:
+            raise ValueError("Cannot build an IVF index over an empty index")
+        nlist = max(1, min(count, nlist or int(np.sqrt(count))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, sample_size or max(nlist * 64, 10_000))
+        sample = np.asarray(self._vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = ~sums.any(axis=1)
+            # Reseed empty lists from random sample rows rather than leaving dead centroids.
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize(sums)
+
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, self.chunk_rows):
+            chunk = np.asarray(self._vectors[start:start + self.chunk_rows], dtype=np.float32)
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable').astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+        for name, value in (('centroids', centroids), ('offsets', offsets), ('rows', order)):
+            np.save(os.path.join(self.directory, f'ivf_{name}.npy'), value)
+        _write_json(self._header_path, dict(self.header, ivf_rows=count, ivf_lists=nlist))
+        self._refresh()
+        return nlist
+
+
+def create_embedder(name: str, api_key: Optional[str] = None, dim: Optional[int] = None, model_name: Optional[str] = None):
+    if name == 'gemini':
+        kwargs = {'dim': dim} if dim else {}
+        return GeminiEmbedder(api_key, model_name or 'models/text-embedding-004', **kwargs)
+    if name == 'transformers':
+        return TransformersEmbedder.from_pretrained(model_name or 'sentence-transformers/all-MiniLM-L6-v2')
+    return HashingEmbedder(dim or 256)
+
+
+def open_index(directory: str, embedder: Any, dtype: str = 'float32') -> EmbeddingIndex:
+    return EmbeddingIndex(directory, dim=embedder.dim, dtype=dtype, embedder=embedder.name)
+
+
+def iter_captions(source: str, field: str) -> Iterator[Tuple[str, str]]:
+    """(path, caption) pairs from a bulk_caption JSONL file or Parquet directory, skipping failed rows.
+
+    field names a task under each row's results. Raises ValueError when the source has successful rows
+    but none of them has that task, which usually means a typo in --field.
+    """
+    if os.path.isdir(source):
+        import pyarrow.parquet as pq
+
+        # Parquet output stores results as a JSON string column.
+        rows = pq.read_table(source, columns=['path', 'status', 'results']).to_pylist()
+        rows = ({'path': row['path'], 'status': row['status'], 'results': json.loads(row['results'] or '{}')} for row in rows)
+        rows = [row for row in rows if row['status'] == 'ok']
+    else:
+        with open(source, encoding='utf-8') as f:
+            rows = (json.loads(line) for line in f if line.strip())
+            rows = [row for row in rows if row.get('status') == 'ok']
+    matched = 0
+    for row in rows:
+        text = (row.get('results') or {}).get(field)
+        if isinstance(text, str) and text:
+            matched += 1
+            yield row['path'], text
+    if rows and not matched:
+        raise ValueError(f"None of the {len(rows)} successful rows in {source} has a {field!r} result")
+
+
+def add_captions(index: EmbeddingIndex, embedder: Any, captions: Iterable[Tuple[str, str]], batch_size: int = 64) -> int:
+    """Embed and append captions whose id is not already indexed; returns rows added."""
+    seen = set(index.ids())
+    added = 0
+    batch = []
+
+    def flush():
+        nonlocal added
+        ids, texts = zip(*batch)
+        index.add(list(ids), list(texts), embedder.embed(list(texts)))
+        added += len(batch)
+        batch.clear()
+
+    for id_, text in captions:
+        if id_ in seen:
+            continue
+        seen.add(id_)
+        batch.append((id_, text))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return added
+
+
+def _add_common_options(parser: argparse.ArgumentParser, defaults: bool = True):
+    # Subcommands get the same options without defaults, so they are accepted after the subcommand (as in
+    # the usage examples) without overriding values given before it.
+    def default(value):
+        return value if defaults else argparse.SUPPRESS
+
+    parser.add_argument('--index', default=default(os.getenv('CAPTIONER_INDEX_DIR', '.captioner_index')), help="Index directory")
+    parser.add_argument('--embedder', choices=['gemini', 'transformers', 'hashing'], default=default('gemini'))
+    parser.add_argument('--embedding-model', default=default(None), help="Gemini or Hugging Face embedding model name")
+    parser.add_argument('--dim', type=int, default=default(None), help="Embedding size (Gemini output_dimensionality, or hashing dim)")
+    parser.add_argument('--api-key', default=default(os.getenv('GOOGLE_API_KEY')), help="Defaults to $GOOGLE_API_KEY")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Semantic search over generated captions.")
+    _add_common_options(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="Index captions from bulk_caption output")
+    _add_common_options(add, defaults=False)
+    add.add_argument('source', help="bulk_caption .jsonl output or Parquet directory")
+    add.add_argument('--field', default='detailed_caption', help="Task result to index")
+    add.add_argument('--dtype', choices=['float32', 'float16'], default='float16', help="Storage type for new indexes")
+    add.add_argument('--batch-size', type=int, default=64)
+
+    ivf = commands.add_parser('build-ivf', help="Build or rebuild the coarse IVF index")
+    _add_common_options(ivf, defaults=False)
+    ivf.add_argument('--nlist', type=int, help="Inverted lists (default: sqrt of the row count)")
+    ivf.add_argument('--iterations', type=int, default=10)
+
+    search = commands.add_parser('search', help="Print the best matches as JSON lines")
+    _add_common_options(search, defaults=False)
+    search.add_argument('query')
+    search.add_argument('-k', type=int, default=10)
+    search.add_argument('--nprobe', type=int, default=8, help="IVF lists to scan; 0 scans every row")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+    try:
+        return _run_command(args)
+    except (FileNotFoundError, ValueError) as e:
+        logger.error("%s", e)
+        return 2
+
+
+def _run_command(args) -> int:
+    if args.command == 'build-ivf':
+        index = EmbeddingIndex(args.index)
+        started = time.perf_counter()
+        nlist = index.build_ivf(args.nlist, iterations=args.iterations)
+        logger.info("Built %d IVF lists over %d rows in %.1fs", nlist, len(index), time.perf_counter() - started)
+        return 0
+
+    if args.embedder == 'gemini' and not args.api_key:
+        logger.error("No API key: pass --api-key or set GOOGLE_API_KEY")
+        return 2
+    embedder = create_embedder(args.embedder, args.api_key, args.dim, args.embedding_model)
+
+    if args.command == 'add':
+        index = open_index(args.index, embedder, args.dtype)
+        started = time.perf_counter()
+        added = add_captions(index, embedder, iter_captions(args.source, args.field), args.batch_size)
+        logger.info("Indexed %d captions in %.1fs (%d rows total)", added, time.perf_counter() - started, len(index))
+        if index.header.get('ivf_rows') and len(index) > 2 * index.header['ivf_rows']:
+            logger.info("More than half the rows are outside the IVF index; consider running build-ivf again")
+        return 0
+
+    index = open_index(args.index, embedder)
+    started = time.perf_counter()
+    results = index.search(embedder.embed([args.query], kind='query')[0], k=args.k, nprobe=args.nprobe or None)
+    logger.info("Search took %.1f ms", (time.perf_counter() - started) * 1000)
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""HTTP API for the captioning tasks, for services that cannot go through the Streamlit page.
+
+    python service.py --port 8080
+
+    POST /v1/images                  upload an image (raw body or multipart field "image"), returns its digest
+    POST /v1/images/{digest}/{task}  run a task on an uploaded image
+    POST /v1/{task}                  upload and run a task in one request
+    GET  /healthz, GET /metrics
+
+Concurrent requests for the same image digest and task share one model call. Distinct calls wait in a
+bounded queue in front of max_concurrency workers; when it is full the service answers 503 with Retry-After.
+Requires starlette and uvicorn (and python-multipart for form uploads).
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+from starlette.applications import Starlette
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from backends import GeminiBackend, TransformersBackend
+from client_pool import create_gemini_model
+from hedging import HedgePolicy
+from image_captioner import PREPARED_IMAGE_SLOTS, TASK_METHODS, ImageCaptioner
+from image_preprocessing import ImageTooLargeError, PreprocessConfig, open_image
+from metrics import OPENMETRICS_CONTENT_TYPE, CaptionerMetrics, Counter, opentelemetry_tracer
+from perceptual_hash import PerceptualIndex
+from rate_limiter import RateLimiter
+from result_cache import ResultCache
+from router import ModelRouter, RoutedBackend
+
+logger = logging.getLogger(__name__)
+
+# Room for the boundaries and part headers around the image in a multipart upload.
+MULTIPART_OVERHEAD_BYTES = 64 * 2**10
+
+
+class ServiceBusyError(Exception):
+    pass
+
+
+class UploadStore:
+    """Uploaded image bytes by SHA-256 digest, least recently used dropped first beyond max_bytes."""
+
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._uploads = OrderedDict()
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._uploads:
+            self._uploads[digest] = data
+            self.total_bytes += len(data)
+        self._uploads.move_to_end(digest)
+        while len(self._uploads) > 1 and self.total_bytes > self.max_bytes:
+            _, evicted = self._uploads.popitem(last=False)
+            self.total_bytes -= len(evicted)
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        data = self._uploads.get(digest)
+        if data is not None:
+            self._uploads.move_to_end(digest)
+        return data
+
+    def __len__(self) -> int:
+        return len(self._uploads)
+
+
+class CaptionService:
+    """Runs captioner tasks off the event loop with single-flight coalescing and a bounded queue.
+
+    All bookkeeping happens on the event loop thread, so it needs no locks. Coalesced requests do not
+    take a queue slot: they wait on the call already in flight.
+    """
+
+    def __init__(
+        self,
+        captioner: ImageCaptioner,
+        preprocess: Optional[PreprocessConfig] = None,
+        max_concurrency: int = 4,
+        max_queue: int = 32,
+        max_upload_bytes: int = 32 * 2**20,
+        upload_store_bytes: int = 256 * 2**20,
+    ):
+        self.captioner = captioner
+        self.preprocess = preprocess or captioner.preprocess
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_upload_bytes = max_upload_bytes
+        self.uploads = UploadStore(upload_store_bytes)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='caption-service')
+        # Uploads are decoded on their own pool, under the same capacity, so they neither queue behind model
+        # calls nor decode without limit ahead of them.
+        self.decode_executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='caption-decode')
+        self.pending = 0
+        self.decoding = 0
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        registry = captioner.metrics.registry if captioner.metrics is not None else None
+        self.requests = Counter(
+            'captioner_service_requests', "Task requests by how they were served: model_call, coalesced or rejected (task 'upload' for rejected uploads).",
+            ('task', 'result'),
+        )
+        if registry is not None:
+            registry.register(self.requests)
+
+    def _decode(self, data: bytes) -> Image.Image:
+        image, _ = open_image(io.BytesIO(data), self.preprocess)
+        return image
+
+    def _run(self, task: str, data: bytes) -> Any:
+        with self._decode(data) as image:
+            return self.captioner.run_task(task, image)
+
+    def _validate(self, data: bytes) -> Dict[str, Any]:
+        with self._decode(data) as image:
+            # open_image only reads the header unless it had to reduce the image; load the pixels so a
+            # truncated or corrupt file is rejected now instead of failing every task call later.
+            image.load()
+            return {'format': image.format, 'width': image.width, 'height': image.height}
+
+    def check_upload_capacity(self):
+        """Raise ServiceBusyError when max_concurrency + max_queue uploads are already being decoded."""
+        if self.decoding >= self.max_concurrency + self.max_queue:
+            self.requests.inc(task='upload', result='rejected')
+            raise ServiceBusyError(f"{self.decoding} uploads being decoded")
+
+    async def upload(self, data: bytes) -> Dict[str, Any]:
+        """Validate and store an upload; raises ImageTooLargeError, UnidentifiedImageError, ValueError
+        for truncated or corrupt data, or ServiceBusyError."""
+        self.check_upload_capacity()
+        self.decoding += 1
+        loop = asyncio.get_running_loop()
+        try:
+            details = await loop.run_in_executor(self.decode_executor, self._validate, data)
+        except UnidentifiedImageError:
+            raise
+        except OSError as e:
+            raise ValueError("Image data is truncated or corrupt.") from e
+        finally:
+            self.decoding -= 1
+        return {'digest': self.uploads.put(data), **details}
+
+    async def run_task(self, task: str, digest: str) -> Any:
+        """The task's result for an uploaded image, sharing any identical call already in flight."""
+        key = (digest, task)
+        call = self._in_flight.get(key)
+        if call is not None:
+            self.requests.inc(task=task, result='coalesced')
+            return await asyncio.shield(call)
+
+        data = self.uploads.get(digest)
+        if data is None:
+            raise KeyError(digest)
+        if self.pending >= self.max_concurrency + self.max_queue:
+            self.requests.inc(task=task, result='rejected')
+            raise ServiceBusyError(f"{self.pending} requests queued or running")
+
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(self.executor, self._run, task, data)
+        self._in_flight[key] = call
+        self.pending += 1
+        call.add_done_callback(partial(self._finished, key))
+        self.requests.inc(task=task, result='model_call')
+        # Shielded so one client disconnecting does not cancel the call for everyone sharing it.
+        return await asyncio.shield(call)
+
+    def _finished(self, key: Tuple[str, str], call: asyncio.Future):
+        self.pending -= 1
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
+        if not call.cancelled() and call.exception() is not None:
+            logger.warning("%s failed for %s: %s", key[1], key[0][:12], call.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self.pending,
+            'decoding': self.decoding,
+            'capacity': self.max_concurrency + self.max_queue,
+            'uploads': len(self.uploads),
+            'model_calls': int(self.requests.total(result='model_call')),
+            'coalesced': int(self.requests.total(result='coalesced')),
+            'rejected': int(self.requests.total(result='rejected')),
+        }
+
+
+def _error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse({'error': message}, status_code=status, headers=headers)
+
+
+async def _limited_stream(request: Request, limit: int, message_limit: Optional[int] = None):
+    """The request body chunk by chunk, raising ImageTooLargeError as soon as more than limit bytes arrive,
+    whatever Content-Length claimed (or whether it was sent at all)."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise ImageTooLargeError(f"Upload exceeds {message_limit or limit} bytes.")
+        yield chunk
+
+
+async def _read_upload(request: Request, limit: int) -> bytes:
+    if int(request.headers.get('content-length') or 0) > limit:
+        raise ImageTooLargeError(f"Upload exceeds {limit} bytes.")
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        # Parsed from a capped stream so the spooled file cannot grow past the limit either.
+        stream = _limited_stream(request, limit + MULTIPART_OVERHEAD_BYTES, message_limit=limit)
+        try:
+            async with contextlib.aclosing(stream):
+                form = await MultiPartParser(request.headers, stream, max_files=4, max_fields=16).parse()
+        except MultiPartException as e:
+            raise ValueError(e.message) from e
+        try:
+            field = form.get('image') or form.get('file')
+            if field is None or isinstance(field, str):
+                raise ValueError("Multipart uploads need an 'image' file field.")
+            if field.size is not None and field.size > limit:
+                raise ImageTooLargeError(f"Upload exceeds {limit} bytes.")
+            data = await field.read()
+        finally:
+            await form.close()
+    else:
+        async with contextlib.aclosing(_limited_stream(request, limit)) as stream:
+            data = b''.join([chunk async for chunk in stream])
+    if not data:
+        raise ValueError("Empty upload.")
+    return data
+
+
+def create_app(service: CaptionService) -> Starlette:
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        service.executor.shutdown(wait=False, cancel_futures=True)
+        service.decode_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def store_upload(request: Request):
+        """The stored upload's digest and details, or an error response."""
+        try:
+            # Checked before the body is read too, so a burst of large uploads is turned away unread.
+            service.check_upload_capacity()
+            return await service.upload(await _read_upload(request, service.max_upload_bytes))
+        except ServiceBusyError as e:
+            return _error(503, f"Service busy: {e}", headers={'Retry-After': '1'})
+        except ImageTooLargeError as e:
+            return _error(413, str(e))
+        except UnidentifiedImageError:
+            return _error(400, "Not a supported image.")
+        except ValueError as e:
+            return _error(400, str(e))
+
+    async def upload(request: Request) -> Response:
+        stored = await store_upload(request)
+        return stored if isinstance(stored, Response) else JSONResponse(stored, status_code=201)
+
+    async def run_task(task: str, digest: str) -> Response:
+        try:
+            result = await service.run_task(task, digest)
+        except KeyError:
+            return _error(404, f"Unknown image {digest}; upload it to /v1/images first.")
+        except ServiceBusyError as e:
+            return _error(503, f"Service busy: {e}", headers={'Retry-After': '1'})
+        except Exception as e:
+            return _error(502, f"Error generating {task.replace('_', ' ')}: {e}")
+        return JSONResponse({'digest': digest, 'task': task, 'result': result})
+
+    async def task_for_digest(request: Request) -> Response:
+        task = request.path_params['task']
+        if task not in TASK_METHODS:
+            return _error(404, f"Unknown task {task}.")
+        return await run_task(task, request.path_params['digest'])
+
+    async def task_for_upload(request: Request) -> Response:
+        task = request.path_params['task']
+        if task not in TASK_METHODS:
+            return _error(404, f"Unknown task {task}.")
+        stored = await store_upload(request)
+        if isinstance(stored, Response):
+            return stored
+        return await run_task(task, stored['digest'])
+
+    async def healthz(request: Request) -> Response:
+        return JSONResponse({'status': 'ok', **service.stats()})
+
+    async def metrics(request: Request) -> Response:
+        if service.captioner.metrics is None:
+            return _error(404, "Metrics are disabled.")
+        return Response(service.captioner.metrics.registry.render(), media_type=OPENMETRICS_CONTENT_TYPE)
+
+    return Starlette(
+        routes=[
+            Route('/v1/images', upload, methods=['POST']),
+            Route('/v1/images/{digest}/{task}', task_for_digest, methods=['POST']),
+            Route('/v1/{task}', task_for_upload, methods=['POST']),
+            Route('/healthz', healthz),
+            Route('/metrics', metrics),
+        ],
+        lifespan=lifespan,
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serve the captioning tasks over HTTP.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8080')))
+    parser.add_argument('--backend', choices=['gemini', 'local'], default='gemini', help="Gemini API or a local CPU image-to-text model")
+    parser.add_argument('--local-model', default='nlpconnect/vit-gpt2-image-captioning', help="Hugging Face model for --backend local")
+    parser.add_argument('--route', action='store_true', help="Route each task to its Gemini model tier")
+    parser.add_argument('--routing-config', help="JSON file of tiers and per-task routes for --route")
+    parser.add_argument('--hedge', action='store_true', help="Duplicate requests slower than the task's rolling p90; first answer wins")
+    parser.add_argument('--hedge-budget', type=float, default=0.05, help="Maximum hedges as a fraction of requests")
+    parser.add_argument('--api-key', default=os.getenv('GOOGLE_API_KEY'), help="Defaults to $GOOGLE_API_KEY")
+    parser.add_argument('--max-concurrency', type=int, default=4, help="Model calls running at once")
+    parser.add_argument('--max-queue', type=int, default=32, help="Distinct calls waiting for a worker before answering 503")
+    parser.add_argument('--max-upload-mb', type=int, default=32)
+    parser.add_argument('--upload-store-mb', type=int, default=256, help="Memory for uploaded images kept by digest")
+    parser.add_argument('--rpm', type=int, default=int(os.getenv('GEMINI_RPM', '60')), help="Requests per minute quota")
+    parser.add_argument('--tpm', type=int, default=int(os.getenv('GEMINI_TPM', '1000000')), help="Tokens per minute quota")
+    parser.add_argument('--cache', help="SQLite file for the result cache (default: in memory)")
+    parser.add_argument('--dedupe-distance', type=int, default=-1, help="Reuse results for images within this dHash Hamming distance and of similar colour (default -1: off)")
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+    if args.backend == 'gemini' and not args.api_key:
+        logger.error("No API key: pass --api-key or set GOOGLE_API_KEY")
+        return 2
+    import uvicorn
+
+    backend = None
+    if args.backend == 'local':
+        backend = TransformersBackend.from_pretrained(args.local_model, max_batch_size=args.max_concurrency)
+    elif args.route:
+        router = ModelRouter.from_file(args.routing_config) if args.routing_config else ModelRouter()
+        backend = RoutedBackend(
+            {tier: GeminiBackend(create_gemini_model(args.api_key, spec.model_name), spec.model_name) for tier, spec in router.tiers.items()},
+            router,
+        )
+    metrics = CaptionerMetrics(tracer=opentelemetry_tracer())
+    captioner = ImageCaptioner(
+        args.api_key,
+        backend=backend,
+        max_concurrency=args.max_concurrency,
+        cache=ResultCache(disk_path=args.cache),
+        rate_limiter=RateLimiter(
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            max_concurrency=args.max_concurrency,
+        ),
+        dedupe_index=PerceptualIndex() if args.dedupe_distance >= 0 else None,
+        dedupe_distance=args.dedupe_distance,
+        metrics=metrics,
+        hedge=HedgePolicy(budget=args.hedge_budget, registry=metrics.registry) if args.hedge else None,
+        prepared_slots=max(PREPARED_IMAGE_SLOTS, args.max_concurrency),
+    )
+    service = CaptionService(
+        captioner,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        max_upload_bytes=args.max_upload_mb * 2**20,
+        upload_store_bytes=args.upload_store_mb * 2**20,
+    )
+    uvicorn.run(create_app(service), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def estimate_bytes(value: Any) -> int:
+    """Rough in-memory size of a result: UTF-8 text length plus a small per-object overhead."""
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 49
+    if isinstance(value, dict):
+        return 64 + sum(estimate_bytes(key) + estimate_bytes(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(estimate_bytes(item) for item in value)
+    return 32
+
+
+class SessionResultStore:
+    """One session's generated results, keyed by image digest, bounded by image count and estimated bytes.
+
+    The most recently used image is never evicted, even when it alone exceeds max_bytes.
+    """
+
+    def __init__(self, max_images: int = 8, max_bytes: int = 1_000_000):
+        self.max_images = max(1, max_images)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, digest: str) -> Dict[str, Any]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            entry = self._entries[digest] = {'results': {}, 'latencies': {}, 'bytes': 0}
+        self._entries.move_to_end(digest)
+        return entry
+
+    def _resize(self, entry: Dict[str, Any]):
+        size = estimate_bytes(entry['results']) + estimate_bytes(entry['latencies'])
+        self.total_bytes += size - entry['bytes']
+        entry['bytes'] = size
+        while len(self._entries) > 1 and (len(self._entries) > self.max_images or self.total_bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted['bytes']
+            self.evictions += 1
+
+    def results(self, digest: str) -> Dict[str, Any]:
+        """A copy of the stored results for digest, marking it most recently used."""
+        with self._lock:
+            if digest not in self._entries:
+                return {}
+            return dict(self._entry(digest)['results'])
+
+    def set(self, digest: str, task: str, value: Any):
+        with self._lock:
+            entry = self._entry(digest)
+            entry['results'][task] = value
+            self._resize(entry)
+
+    def update(self, digest: str, values: Dict[str, Any]):
+        with self._lock:
+            entry = self._entry(digest)
+            entry['results'].update(values)
+            self._resize(entry)
+
+    def latency(self, digest: str, task: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            return entry['latencies'].get(task) if entry is not None else None
+
+    def set_latency(self, digest: str, task: str, timings: Dict[str, float]):
+        with self._lock:
+            entry = self._entry(digest)
+            entry['latencies'][task] = timings
+            self._resize(entry)
+
+    def clear(self, digest: str):
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+            if entry is not None:
+                self.total_bytes -= entry['bytes']
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import CancelledError, Executor, Future
+from typing import Any, Callable, Dict, Optional
+
+
+class SpeculativeRunner:
+    """Runs one likely-next task in the background for the current upload and hands the result to the first taker.
+
+    Starting work for a different digest cancels the previous speculation; if it is already running, its
+    result is discarded when it finishes.
+    """
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+        self.failed = 0
+        self._key = None
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def start(self, digest: str, task: str, call: Callable[[], Any]):
+        """Speculate call for (digest, task), unless that speculation is already pending or done."""
+        with self._lock:
+            if self._key == (digest, task):
+                return
+            self._cancel()
+            self._key = (digest, task)
+            self._future = self.executor.submit(call)
+            self.started += 1
+
+    def cancel(self):
+        with self._lock:
+            self._cancel()
+
+    def _cancel(self):
+        if self._future is not None:
+            self._future.cancel()
+            self.discarded += 1
+        self._key = None
+        self._future = None
+
+    def take(self, digest: str, task: str, timeout: Optional[float] = None) -> Optional[Any]:
+        """The speculative result for (digest, task), waiting for it if still running; None if there is none or it failed."""
+        with self._lock:
+            if self._key != (digest, task):
+                return None
+            future = self._future
+            self._key = None
+            self._future = None
+        try:
+            value = future.result(timeout=timeout)
+        except CancelledError:
+            return None
+        except Exception:
+            self.failed += 1
+            return None
+        self.used += 1
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.used + self.discarded + self.failed
+        return {
+            'started': self.started,
+            'used': self.used,
+            'discarded': self.discarded,
+            'failed': self.failed,
+            'usage_rate': self.used / finished if finished else 0.0,
+        }
@@ -4,9 +4,7 @@ import time
 from dotenv import load_dotenv
 from PIL import Image
 import google.generativeai as genai
-from pdf2image import convert_from_path
-import pytesseract
-import pdfplumber
+from pdf_extraction import create_pool, extract_pages, ocr_pages
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime
@@ -17,12 +15,16 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import traceback
 import logging
+from concurrent.futures.process import BrokenProcessPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+
 st.set_page_config(
     page_title="AI Resume Analyzer Pro",
     page_icon="📊",
@@ -200,6 +202,10 @@ if 'debug_mode' not in st.session_state:
     st.session_state.debug_mode = False
 if 'api_configured' not in st.session_state:
     st.session_state.api_configured = False
+if 'parallel_extraction' not in st.session_state:
+    st.session_state.parallel_extraction = PDF_EXTRACTION_WORKERS > 1
+if 'hybrid_extraction' not in st.session_state:
+    st.session_state.hybrid_extraction = True
 
 st.markdown("""
 <div class="api-key-section">
@@ -258,6 +264,18 @@ with st.sidebar:
     st.markdown("### 🛠️ Settings")
     debug_mode = st.checkbox("Enable Debug Mode", value=st.session_state.debug_mode)
     st.session_state.debug_mode = debug_mode
+    parallel_extraction = st.checkbox(
+        "Parallel PDF Extraction",
+        value=st.session_state.parallel_extraction,
+        help=f"Extract long PDFs across {PDF_EXTRACTION_WORKERS} worker processes"
+    )
+    st.session_state.parallel_extraction = parallel_extraction
+    hybrid_extraction = st.checkbox(
+        "Hybrid OCR",
+        value=st.session_state.hybrid_extraction,
+        help="OCR only the pages without a text layer, instead of OCR'ing the whole PDF when no page has text"
+    )
+    st.session_state.hybrid_extraction = hybrid_extraction
     
     st.markdown("---")
     
@@ -292,56 +310,101 @@ with st.sidebar:
                 st.write(f"**Date:** {analysis['timestamp']}")
                 st.write(f"**Score:** {analysis.get('score', 'N/A')}/100")
 
+@st.cache_resource
+def get_extraction_pool(workers):
+    # Worker processes start on first use, so short resumes that are extracted inline never spawn them.
+    return create_pool(workers)
+
+def format_page_numbers(numbers):
+    """Compact page list for display, e.g. [1, 2, 3, 5] -> 'pages 1-3, 5'."""
+    runs = []
+    for number in numbers:
+        if runs and number == runs[-1][1] + 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    label = "page" if len(numbers) == 1 else "pages"
+    return label + " " + ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in runs)
+
 def extract_text_from_pdf(pdf_path):
-    """Enhanced PDF text extraction with better error handling"""
-    text = ""
+    """Enhanced PDF text extraction with better error handling.
+
+    Returns the text, a summary of the methods used and one record per page saying how it was read.
+    """
     extraction_methods = []
+    pages = []
     
     try:
         logger.info("Attempting direct text extraction...")
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        
-        if text.strip():
-            extraction_methods.append("Direct text extraction")
-            logger.info(f"✅ Direct extraction successful. Length: {len(text)}")
-            if st.session_state.debug_mode:
-                st.success(f"✅ Direct text extraction successful ({len(text)} characters)")
-            return text.strip(), extraction_methods
-        else:
-            logger.warning("Direct text extraction returned empty result")
-            
+        workers = PDF_EXTRACTION_WORKERS if st.session_state.parallel_extraction else 1
+        pool = get_extraction_pool(workers) if workers > 1 else None
+        start_time = time.time()
+        try:
+            pages = extract_pages(pdf_path, workers=workers, executor=pool)
+        except BrokenProcessPool:
+            if pool is None:
+                raise
+            # A worker died (killed for memory, or crashed on a bad file). The cached pool stays broken for
+            # every later upload, so replace it and try this document once more.
+            logger.warning("PDF extraction pool is broken; starting a new one")
+            pool.shutdown(wait=False)
+            get_extraction_pool.clear()
+            pool = get_extraction_pool(workers)
+            pages = extract_pages(pdf_path, workers=workers, executor=pool)
+        elapsed = time.time() - start_time
+        logger.info(f"Extracted {len(pages)} pages in {elapsed:.2f}s ({len(pages) / max(elapsed, 1e-6):.1f} pages/s, {workers} workers)")
     except Exception as e:
         logger.error(f"Direct text extraction failed: {e}")
         if st.session_state.debug_mode:
             st.warning(f"Direct extraction failed: {e}")
 
-    try:
-        logger.info("Attempting OCR extraction...")
-        images = convert_from_path(pdf_path, dpi=300)  
-        ocr_text = ""
-        
-        for i, image in enumerate(images):
-            image = image.convert('L')  
-            page_text = pytesseract.image_to_string(image, config='--psm 6')
-            ocr_text += page_text + "\n"
-            
-        if ocr_text.strip():
-            extraction_methods.append("OCR extraction")
-            logger.info(f"✅ OCR extraction successful. Length: {len(ocr_text)}")
+    if not pages:
+        scanned = None
+    elif st.session_state.hybrid_extraction:
+        scanned = [page["page"] for page in pages if page["method"] == "ocr"]
+    elif any(page["text"].strip() for page in pages):
+        # Text layer first: any text at all means no page is OCR'd.
+        scanned = []
+        for page in pages:
+            page["method"] = "text"
+    else:
+        scanned = [page["page"] for page in pages]
+
+    text_pages = [page["page"] for page in pages if page["method"] == "text"]
+    if text_pages:
+        extraction_methods.append(f"Direct text extraction ({format_page_numbers(text_pages)})")
+
+    if scanned is None or scanned:
+        try:
+            logger.info(f"Attempting OCR extraction of {len(scanned) if scanned is not None else 'all'} pages...")
+            start_time = time.time()
+            texts = ocr_pages(pdf_path, pages=scanned, workers=OCR_WORKERS)
+            elapsed = time.time() - start_time
+            logger.info(f"OCR'd {len(texts)} pages in {elapsed:.2f}s ({len(texts) / max(elapsed, 1e-6):.1f} pages/s, {OCR_WORKERS} workers)")
+            if scanned is None:
+                pages = [{"page": number, "text": page_text, "chars": None, "image_coverage": None, "method": "ocr"}
+                         for number, page_text in enumerate(texts, start=1)]
+                scanned = [page["page"] for page in pages]
+            else:
+                for number, page_text in zip(scanned, texts):
+                    pages[number - 1]["text"] = page_text
+            extraction_methods.append(f"OCR extraction ({format_page_numbers(scanned)})")
+        except Exception as e:
+            logger.error(f"OCR failed: {e}")
             if st.session_state.debug_mode:
-                st.success(f"✅ OCR extraction successful ({len(ocr_text)} characters)")
-            return ocr_text.strip(), extraction_methods
-            
-    except Exception as e:
-        logger.error(f"OCR failed: {e}")
-        if st.session_state.debug_mode:
-            st.error(f"OCR extraction failed: {e}")
+                st.error(f"OCR extraction failed: {e}")
+            for number in scanned or []:
+                pages[number - 1]["method"] = "ocr failed"
+
+    for page in pages:
+        logger.info(f"Page {page['page']}: {page['method']} ({len(page['text'])} characters)")
 
-    return "", extraction_methods
+    text = "\n".join(page["text"] for page in pages if page["text"]).strip()
+    if text:
+        logger.info(f"✅ Extraction successful. Length: {len(text)}")
+        if st.session_state.debug_mode:
+            st.success(f"✅ Text extraction successful ({len(text)} characters, {'; '.join(extraction_methods)})")
+    return text, extraction_methods, pages
 
 def validate_resume_text(text):
     """Validate extracted resume text"""
@@ -534,12 +597,25 @@ if st.session_state.api_configured:
                 status_text.text("📄 Extracting text from PDF...")
                 progress_bar.progress(25)
                 
-                resume_text, extraction_methods = extract_text_from_pdf("uploaded_resume.pdf")
+                resume_text, extraction_methods, page_report = extract_text_from_pdf("uploaded_resume.pdf")
                 st.session_state.resume_text = resume_text
                 
                 if st.session_state.debug_mode:
                     st.markdown("### 🔍 Debug: Text Extraction")
                     st.write(f"**Extraction methods used:** {', '.join(extraction_methods)}")
+                    st.dataframe(
+                        pd.DataFrame([
+                            {
+                                "Page": page["page"],
+                                "Method": page["method"],
+                                "Text layer chars": page["chars"],
+                                "Image coverage": page["image_coverage"],
+                                "Extracted chars": len(page["text"]),
+                            }
+                            for page in page_report
+                        ]),
+                        hide_index=True
+                    )
                     st.write(f"**Text length:** {len(resume_text)} characters")
                     st.text_area("Extracted Text (first 500 chars)", resume_text[:500], height=150)
                 
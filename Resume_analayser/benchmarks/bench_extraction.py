@@ -0,0 +1,134 @@
+"""Pages/second of extract_pages (or, with --ocr, ocr_pages) at several worker counts.
+
+Without a PDF argument, a text-heavy synthetic document is generated, so the benchmark needs nothing
+beyond the app's requirements.
+
+    python benchmarks/bench_extraction.py --pages 64
+    python benchmarks/bench_extraction.py portfolio.pdf --workers 1 2 4 8
+    python benchmarks/bench_extraction.py scanned.pdf --ocr
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_extraction import count_pages, create_pool, extract_pages, ocr_pages  # noqa: E402
+
+WORDS = (
+    "experience education skills python project managed team developed university degree analysis "
+    "design data cloud leadership delivered platform customers improved latency research published"
+).split()
+
+
+def make_pdf(path, pages, lines_per_page=60, seed=0):
+    """Write a pages-long A4 PDF of resume-like Helvetica text, with no dependencies."""
+    rng = random.Random(seed)
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % i for i in page_ids) + b"] /Count %d >>" % pages,
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_id in page_ids:
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = stream.encode("ascii")
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (page_id + 1))
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number in sorted(objects):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def bench_ocr(pdf_path, workers, repeats):
+    pages = count_pages(pdf_path)
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        texts = ocr_pages(pdf_path, workers=workers)
+        seconds.append(time.perf_counter() - started)
+    median = statistics.median(seconds)
+    return {
+        "workers": workers,
+        "pages": pages,
+        "characters": sum(len(text) for text in texts),
+        "median_seconds": round(median, 4),
+        "pages_per_second": round(pages / median, 2),
+    }
+
+
+def bench(pdf_path, workers, repeats):
+    pages = count_pages(pdf_path)
+    # A warm pool, as the app keeps one, so process start-up is not billed to every run.
+    pool = create_pool(workers) if workers > 1 else None
+    try:
+        if pool is not None:
+            extract_pages(pdf_path, workers=workers, executor=pool)
+        seconds = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            records = extract_pages(pdf_path, workers=workers, executor=pool)
+            seconds.append(time.perf_counter() - started)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    median = statistics.median(seconds)
+    return {
+        "workers": workers,
+        "pages": pages,
+        "characters": sum(len(page["text"]) for page in records),
+        "median_seconds": round(median, 4),
+        "pages_per_second": round(pages / median, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="PDF to extract (default: a generated one)")
+    parser.add_argument("--pages", type=int, default=32, help="Pages in the generated PDF")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--ocr", action="store_true", help="Benchmark the OCR pipeline instead of the text layer")
+    parser.add_argument("-o", "--output", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = args.pdf
+        if pdf_path is None:
+            pdf_path = os.path.join(tmp, "bench.pdf")
+            make_pdf(pdf_path, args.pages)
+        run = bench_ocr if args.ocr else bench
+        results = [run(pdf_path, workers, args.repeats) for workers in args.workers]
+
+    baseline = results[0]["pages_per_second"]
+    print(f"{'workers':>7} {'pages':>6} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+    for result in results:
+        print(f"{result['workers']:>7} {result['pages']:>6} {result['median_seconds']:>9.3f} "
+              f"{result['pages_per_second']:>9.1f} {result['pages_per_second'] / baseline:>7.2f}x")
+    # Page bitmaps live in this process; pdftoppm and tesseract run as children and are not counted.
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"({os.cpu_count()} CPUs, peak RSS {peak_mb:.0f} MB)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "peak_rss_mb": round(peak_mb), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""PDF text extraction that can shard pages across worker processes.
+
+Kept free of Streamlit so worker processes can import it without running the app.
+"""
+import math
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pdfplumber
+import pytesseract
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+# Each shard re-opens the PDF, so very small shards spend more time parsing than extracting.
+MIN_SHARD_PAGES = 4
+
+# A page is only sent to OCR when its text layer is thinner than this...
+MIN_TEXT_CHARS = 32
+# ...and either absent or mostly covered by images (a scan with a stray header or page number).
+MIN_IMAGE_COVERAGE = 0.5
+
+OCR_DPI = 300
+OCR_CONFIG = "--psm 6"
+# Pages rendered per pdftoppm call. Together with the OCR worker count this bounds how many page
+# bitmaps are alive at once (about 8.7 MB each for grayscale A4 at 300 dpi).
+OCR_WINDOW_PAGES = 2
+
+
+def create_pool(workers):
+    """Process pool for extract_pages; spawned so it is safe to create from a threaded Streamlit server."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def count_pages(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def image_coverage(page):
+    """Fraction of the page covered by embedded images; overlapping images count twice, capped at 1."""
+    x0, top, x1, bottom = page.bbox
+    page_area = (x1 - x0) * (bottom - top)
+    if page_area <= 0:
+        return 0.0
+    covered = 0.0
+    for image in page.images:
+        width = min(image["x1"], x1) - max(image["x0"], x0)
+        height = min(image["bottom"], bottom) - max(image["top"], top)
+        if width > 0 and height > 0:
+            covered += width * height
+    return min(1.0, covered / page_area)
+
+
+def classify_page(chars, coverage, min_chars=MIN_TEXT_CHARS, min_coverage=MIN_IMAGE_COVERAGE):
+    """'text' when the page's text layer can be used, 'ocr' when the page needs to be read from pixels."""
+    if chars >= min_chars:
+        return "text"
+    if chars == 0 or coverage >= min_coverage:
+        return "ocr"
+    return "text"
+
+
+def extract_page_range(pdf_path, start, stop):
+    """One record per page in [start, stop): 1-based page number, text layer ('' if none),
+    character count, image coverage and the method classify_page picked for it."""
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for number, page in enumerate(pdf.pages[start:stop], start=start + 1):
+            chars = len(page.chars)
+            coverage = image_coverage(page)
+            pages.append({
+                "page": number,
+                "text": page.extract_text() or "",
+                "chars": chars,
+                "image_coverage": round(coverage, 3),
+                "method": classify_page(chars, coverage),
+            })
+            # Drop the parsed layout objects so long documents do not accumulate them.
+            page.close()
+    return pages
+
+
+def shard_pages(page_count, workers, min_shard_pages=MIN_SHARD_PAGES):
+    """Split page_count pages into contiguous (start, stop) ranges, about two per worker."""
+    shards = max(1, min(workers * 2, math.ceil(page_count / min_shard_pages)))
+    size = math.ceil(page_count / shards)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def extract_pages(pdf_path, workers=1, executor: Executor = None, min_shard_pages=MIN_SHARD_PAGES):
+    """Records from extract_page_range for every page, in page order.
+
+    With workers > 1 and enough pages for more than one shard, pages are extracted in parallel processes,
+    on executor if given or a temporary pool otherwise. Documents too short to shard are extracted inline.
+    """
+    pdf_path = os.path.abspath(pdf_path)
+    page_count = count_pages(pdf_path)
+    shards = shard_pages(page_count, workers, min_shard_pages) if workers > 1 else [(0, page_count)]
+    if len(shards) <= 1:
+        return extract_page_range(pdf_path, 0, page_count)
+
+    pool = executor or create_pool(min(workers, len(shards)))
+    try:
+        futures = [pool.submit(extract_page_range, pdf_path, start, stop) for start, stop in shards]
+        return [page for future in futures for page in future.result()]
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+
+def iter_page_windows(page_numbers, window=OCR_WINDOW_PAGES):
+    """Group ascending 1-based page numbers into contiguous (first_page, last_page) runs of at most window
+    pages, as pdf2image expects."""
+    first_page = last_page = None
+    for number in page_numbers:
+        if first_page is not None and number == last_page + 1 and number - first_page < window:
+            last_page = number
+            continue
+        if first_page is not None:
+            yield first_page, last_page
+        first_page = last_page = number
+    if first_page is not None:
+        yield first_page, last_page
+
+
+def ocr_image(image, config=OCR_CONFIG):
+    try:
+        return pytesseract.image_to_string(image, config=config)
+    finally:
+        image.close()
+
+
+def ocr_pages(pdf_path, pages=None, dpi=OCR_DPI, workers=None, window=OCR_WINDOW_PAGES, config=OCR_CONFIG):
+    """OCR text of the given 1-based pages (default: all of them), in ascending page order, without
+    rendering the whole document up front.
+
+    Pages are rendered a window at a time, already grayscale, and handed to a pool of OCR threads (each
+    tesseract call is its own process). Rendering stops whenever workers + window pages are waiting or
+    being read, so peak memory depends on those two settings and not on the page count.
+    """
+    workers = workers or os.cpu_count() or 1
+    if pages is None:
+        # Counted with poppler rather than pdfplumber, so OCR still works on files pdfplumber cannot parse.
+        pages = range(1, pdfinfo_from_path(pdf_path)["Pages"] + 1)
+    # Tesseract's own OpenMP threads would oversubscribe the cores once several pages run in parallel.
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    futures = []
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr") as pool:
+        for first_page, last_page in iter_page_windows(sorted(set(pages)), window):
+            while len(in_flight) > workers:
+                _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, grayscale=True)
+            for image in images:
+                future = pool.submit(ocr_image, image, config)
+                futures.append(future)
+                in_flight.add(future)
+            del images
+        return [future.result() for future in futures]